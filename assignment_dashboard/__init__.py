@@ -4,6 +4,7 @@ import os
 from assignment_dashboard.app import app
 import assignment_dashboard.commands
 import assignment_dashboard.views
+import assignment_dashboard.api
 
 if 'GITHUB_CLIENT_ID' in os.environ:
     import assignment_dashboard.oauth
@@ -0,0 +1,77 @@
+"""Authorization index: the ids of the source repos and assignments that a user can access.
+
+The index is computed with a single query, and cached in the app cache for ACCESS_INDEX_TIMEOUT seconds, so that an
+access check is a set membership test. The signed-in user's id, login, and avatar are cached for as long, so that a
+request doesn't query the user either.
+
+`flask updatedb` invalidates the indexes of users whose memberships change. This reaches the web processes only if
+the app cache is shared, i.e. REDIS_HOST is set. Otherwise each process has its own cache, and the entries are kept
+for only LOCAL_ACCESS_INDEX_TIMEOUT seconds, which bounds how long a revoked membership still grants access.
+"""
+
+from collections import namedtuple
+from typing import Iterable
+
+from . import app  # for cache
+from .database import session
+from .models import Assignment, Repo, User, organization_users_table
+
+AccessIndex = namedtuple('AccessIndex', 'repo_ids assignment_ids')
+SessionUser = namedtuple('SessionUser', 'id login avatar_url')
+
+
+def _cache_key(user_id: int) -> str:
+    return 'access/%d' % user_id
+
+
+def _cache_timeout() -> int:
+    if 'REDIS_HOST' in app.config:
+        return app.config['ACCESS_INDEX_TIMEOUT']
+    return min(app.config['ACCESS_INDEX_TIMEOUT'], app.config['LOCAL_ACCESS_INDEX_TIMEOUT'])
+
+
+def get_session_user(login: str, refresh=False) -> SessionUser:
+    """Return the id, login, and avatar of the user with login, from the cache unless refresh is true, or None."""
+    key = 'access/login/%s' % login
+    user = None if refresh else app.cache.get(key)
+    if user is None:
+        row = session.query(User.id, User.login, User.avatar_url).filter(User.login == login).first()
+        if row is None:
+            return None
+        user = SessionUser(*row)
+        app.cache.set(key, user, timeout=_cache_timeout())
+    return user
+
+
+def compute_access_index(user_id: int) -> AccessIndex:
+    """Query the ids of the source repos owned by the user's organizations, and of their assignments."""
+    # organization_users stores the member in the organization_id column, and the organization in the user_id column.
+    # See User.organizations.
+    rows = (session.query(Repo.id, Assignment.id)
+            .join(organization_users_table, organization_users_table.c.user_id == Repo.owner_id)
+            .outerjoin(Assignment, Assignment.repo_id == Repo.id)
+            .filter(organization_users_table.c.organization_id == user_id)
+            .filter(Repo.source_id.is_(None))
+            .all())
+    return AccessIndex(frozenset(repo_id for repo_id, _ in rows),
+                       frozenset(assignment_id for _, assignment_id in rows if assignment_id is not None))
+
+
+def get_access_index(user_id: int, refresh=False) -> AccessIndex:
+    """Return the user's AccessIndex, from the cache unless refresh is true."""
+    key = _cache_key(user_id)
+    index = None if refresh else app.cache.get(key)
+    if index is None:
+        index = compute_access_index(user_id)
+        app.cache.set(key, index, timeout=_cache_timeout())
+    return index
+
+
+def invalidate_access_indexes(user_ids: Iterable[int]):
+    """Remove the cached access indexes of users whose memberships have changed.
+
+    Without a shared cache (REDIS_HOST), this only affects this process; see the module docstring.
+    """
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        app.cache.delete_many(*keys)
@@ -0,0 +1,147 @@
+"""Full-text search over students' answers.
+
+Each cell of a student's notebook that isn't in the assignment notebook is recorded as an AnswerCell, keyed by
+assignment, question position, and student. A student's cells are re-indexed when the database updater records a new
+version of their file, and an assignment's cells are re-indexed when it's collated, since that's when its questions
+are determined. Only the cells that changed are written.
+
+On SQLite, the cells are indexed by an FTS5 table; on PostgreSQL, by a GIN index on their tsvector. Other databases
+fall back to a substring search.
+"""
+
+from typing import Iterable, Iterator, List, Mapping, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, and_, func, literal_column
+from sqlalchemy.orm import joinedload
+
+from .database import session
+from .models import AnswerCell, Assignment, AssignmentQuestion, FileCommit, Repo, User
+from .nb_helpers import read_submission_notebook, split_notebook_sections
+from .notebook_store import iter_file_contents
+
+SEARCH_RESULT_LIMIT = 100
+SNIPPET_LINES = 3
+
+# The FTS5 table. It isn't part of the models' metadata, since it's only created on SQLite.
+answer_cell_fts = Table('answer_cell_fts', MetaData(), Column('rowid', Integer))
+
+
+def iter_answer_cells(assignment_nb, question_names: List[str], nb) -> Iterator[Tuple[int, str]]:
+    """Yield (position, source) for each cell of nb that isn't in assignment_nb.
+
+    Position is the index in question_names of the question whose section contains the cell.
+    """
+    if not nb or not question_names:
+        return
+    prompts = {cell.source.strip() for cell in assignment_nb.cells} if assignment_nb else set()
+    for position, section in enumerate(split_notebook_sections(nb, question_names)):
+        for cell in section.cells:
+            source = cell.source.strip()
+            if source and source not in prompts:
+                yield position, source
+
+
+def update_answer_cells(assignment_id: int, user_cells: Mapping[int, Iterable[Tuple[int, str]]]):
+    """Set the answer cells of each user_id in user_cells, to its (position, source) tuples.
+
+    Cells that are already indexed are left in place. The caller is responsible for committing the session.
+    """
+    if not user_cells:
+        return
+    saved = {}
+    for cell in (session.query(AnswerCell)
+                 .filter(AnswerCell.assignment_id == assignment_id)
+                 .filter(AnswerCell.user_id.in_(list(user_cells.keys())))):
+        saved.setdefault((cell.user_id, cell.position, cell.source), []).append(cell)
+    for user_id, cells in user_cells.items():
+        for position, source in cells:
+            if saved.get((user_id, position, source)):
+                saved[user_id, position, source].pop()
+            else:
+                session.add(AnswerCell(assignment_id=assignment_id, position=position, user_id=user_id, source=source))
+    for cells in saved.values():
+        for cell in cells:
+            session.delete(cell)
+
+
+def index_assignment_answers(assignment: Assignment, question_names: List[str], user_notebooks: Mapping):
+    """Index the answers in user_notebooks, a dict of login -> (user_id, notebook), to assignment's questions."""
+    owner_login = assignment.repo.owner.login
+    assignment_nb = user_notebooks.get(owner_login, (None, None))[1]
+    update_answer_cells(assignment.id, {
+        user_id: list(iter_answer_cells(assignment_nb, question_names, nb))
+        for login, (user_id, nb) in user_notebooks.items()
+        if login != owner_login})
+
+
+def index_response_files(repo: Repo, file_commits: Iterable[FileCommit]):
+    """Re-index a student's answers, from the files in file_commits that are responses to an assignment.
+
+    This does nothing if repo isn't a fork, or for assignments that haven't been collated (and therefore have no
+    questions yet).
+    """
+    if not repo.source_id:
+        return
+    file_commits = {fc.path: fc for fc in sorted(file_commits, key=lambda fc: fc.mod_time)}
+    assignments = [assignment
+                   for assignment in (session.query(Assignment)
+                                      .options(joinedload(Assignment.questions))
+                                      .options(joinedload(Assignment.file))
+                                      .filter(Assignment.repo_id == repo.source_id)
+                                      .filter(Assignment.path.in_(file_commits.keys() or [None])))
+                   if assignment.questions and assignment.file]
+    if not assignments:
+        return
+
+    shas = {file_commits[a.path].sha for a in assignments} | {a.file.sha for a in assignments}
+    contents = dict(iter_file_contents(list(shas), include_outputs=False))
+    for assignment in assignments:
+        question_names = [q.question_name for q in sorted(assignment.questions, key=lambda q: q.position)]
+        nb = read_submission_notebook(contents.get(file_commits[assignment.path].sha))
+        assignment_nb = read_submission_notebook(contents.get(assignment.file.sha))
+        update_answer_cells(assignment.id, {repo.owner_id: list(iter_answer_cells(assignment_nb, question_names, nb))})
+    session.commit()
+
+
+def search_answers(repo_id: int, query: str, limit=SEARCH_RESULT_LIMIT) -> List:
+    """Return the answer cells to the assignments of repo_id that match query, best matches first.
+
+    Each result is a tuple (AnswerCell, Assignment, User, question_name).
+    """
+    terms = query.split()
+    if not terms:
+        return []
+    results = (session.query(AnswerCell, Assignment, User, AssignmentQuestion.question_name)
+               .join(Assignment, Assignment.id == AnswerCell.assignment_id)
+               .join(User, User.id == AnswerCell.user_id)
+               .outerjoin(AssignmentQuestion, and_(AssignmentQuestion.assignment_id == AnswerCell.assignment_id,
+                                                   AssignmentQuestion.position == AnswerCell.position))
+               .filter(Assignment.repo_id == repo_id))
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # quote each term, so that FTS5 query syntax in the search string is matched literally
+        fts_query = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+        results = (results
+                   .join(answer_cell_fts, answer_cell_fts.c.rowid == AnswerCell.id)
+                   .filter(literal_column('answer_cell_fts').op('MATCH')(fts_query))
+                   .order_by(literal_column('answer_cell_fts.rank')))
+    elif dialect == 'postgresql':
+        document = func.to_tsvector('english', AnswerCell.source)
+        ts_query = func.plainto_tsquery('english', query)
+        results = (results
+                   .filter(document.op('@@')(ts_query))
+                   .order_by(func.ts_rank(document, ts_query).desc()))
+    else:
+        for term in terms:
+            results = results.filter(AnswerCell.source.ilike('%%%s%%' % term))
+        results = results.order_by(Assignment.id, AnswerCell.position)
+    return results.limit(limit).all()
+
+
+def get_answer_snippet(source: str, query: str, line_count=SNIPPET_LINES) -> str:
+    """Return the first line_count lines of source that contain a term of query, or its first lines if none do."""
+    terms = [term.lower() for term in query.split()]
+    lines = source.splitlines()
+    matches = [line for line in lines if any(term in line.lower() for term in terms)]
+    return '\n'.join((matches or lines)[:line_count])
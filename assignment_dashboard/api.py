@@ -0,0 +1,82 @@
+"""Versioned machine-readable API.
+
+Responses are JSON, or MessagePack if the msgpack package is installed and the request specifies `?format=msgpack` or
+`Accept: application/msgpack`.
+"""
+
+import json
+from datetime import datetime
+
+import dateutil.parser
+import pytz
+from flask import Response, abort, request
+
+from . import app
+from .decorators import requires_access
+from .viewmodel import get_response_matrix, get_response_matrix_version
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+API_VERSION = 1
+MSGPACK_MIME_TYPES = ['application/msgpack', 'application/x-msgpack']
+
+
+def encode_value(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError("%r is not serializable" % obj)
+
+
+def use_msgpack() -> bool:
+    if request.args.get('format'):
+        return request.args['format'] == 'msgpack'
+    return request.accept_mimetypes.best_match(['application/json'] + MSGPACK_MIME_TYPES) in MSGPACK_MIME_TYPES
+
+
+def api_response(data, etag: str) -> Response:
+    if use_msgpack():
+        if not msgpack:
+            abort(406)
+        response = Response(msgpack.packb(data, default=encode_value, use_bin_type=True),
+                            mimetype=MSGPACK_MIME_TYPES[0])
+    else:
+        response = Response(json.dumps(data, default=encode_value, separators=(',', ':')),
+                            mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
+@app.route('/api/v1/assignment_repo/<int:repo_id>/responses')
+@requires_access('repo')
+def api_assignment_repo_responses(repo_id: int):
+    """Return the assignments, students, file statuses, and per-question statuses of an assignment repo.
+
+    The `since` query parameter restricts the file statuses to those that the updater recorded after that time. Pass
+    the `last_modified` value from a previous response, to fetch only the changes since that response. This compares
+    the times that files were recorded, not committed, so that it includes commits that were pushed or fetched late.
+    """
+    since = request.args.get('since')
+    if since:
+        try:
+            since = dateutil.parser.parse(since)
+        except ValueError:
+            abort(400)
+        if since.tzinfo:
+            # the database stores naive UTC times
+            since = since.astimezone(pytz.utc).replace(tzinfo=None)
+
+    etag = '%s-%s-%s' % (get_response_matrix_version(repo_id), since and since.isoformat(), use_msgpack())
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    data = get_response_matrix(repo_id, since=since)
+    data.update(version=API_VERSION,
+                since=since,
+                last_modified=data['last_modified'] or since)
+    return api_response(data, etag)
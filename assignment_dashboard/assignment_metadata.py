@@ -0,0 +1,140 @@
+"""Extract assignment metadata (name, due date, and questions) from assignment notebooks.
+
+This runs when the database is updated from GitHub, once for each version of an assignment notebook, so that the web
+app doesn't need to parse assignment notebooks in order to display them.
+"""
+
+import re
+from datetime import datetime
+from itertools import takewhile
+from typing import List
+
+import dateutil.parser
+import pytz
+from sqlalchemy.orm import joinedload, subqueryload, undefer
+
+from .app import app
+from .database import session
+from .models import Assignment, AssignmentQuestion, FileContent, Repo
+
+
+def compute_assignment_name(path: str) -> str:
+    NOTEBOOK_ASSIGNMENT_PATH_RE = r'day(\d+)_reading_journal\.ipynb'
+    NOTEBOOK_ASSIGNMENT_PATH_TITLE_TEMPLATE = r'Journal #\1'
+    return re.sub(NOTEBOOK_ASSIGNMENT_PATH_RE, NOTEBOOK_ASSIGNMENT_PATH_TITLE_TEMPLATE, path)
+
+
+def update_assignment_file_list(assignment_repo, assignment_paths):
+    saved_assignments = {assignment.path: assignment
+                         for assignment in assignment_repo.assignments}
+    if set(assignment_paths) == set(saved_assignments):
+        return
+
+    for assignment in assignment_repo.assignments:
+        if assignment.path not in assignment_paths:
+            session.delete(assignment)
+    assignment_repo.assignments = [(saved_assignments.get(path) or
+                                    Assignment(repo_id=assignment_repo.id, path=path, name=compute_assignment_name(path)))
+                                   for path in assignment_paths]
+    session.commit()
+
+
+def update_assignment_questions(assignment: Assignment, question_names: List[str]):
+    """Set an assignment's questions to question_names, reusing the existing AssignmentQuestion rows by position."""
+    questions = {question.position: question for question in assignment.questions}
+    for position, question_name in enumerate(question_names):
+        question = questions.get(position)
+        if question:
+            question.question_name = question_name
+        else:
+            assignment.questions.append(AssignmentQuestion(position=position, question_name=question_name))
+    for question in assignment.questions[:]:
+        if question.position >= len(question_names):
+            assignment.questions.remove(question)
+
+
+def load_assignment_contents(assignments: List[Assignment]):
+    """Load the file contents of assignments, with a single query (and one more for notebooks stored as cells).
+
+    The assignments' files should already be loaded, e.g. with joinedload(Assignment.file).
+    """
+    shas = {assignment.file.sha for assignment in assignments if assignment.file}
+    if shas:
+        (session.query(FileContent)
+         .options(undefer(FileContent.content), undefer(FileContent.notebook_data), subqueryload(FileContent.cells))
+         .filter(FileContent.sha.in_(shas))
+         .all())  # for effect: this populates the deferred content of the FileContents in the session
+
+
+def due_date_to_utc(due_date: datetime) -> datetime:
+    """Return a due date from parse_due_date, which is in COURSE_TIME_ZONE, as a naive UTC datetime, or None.
+
+    Commit and file revision times are naive UTC datetimes; use this to compare them with due dates.
+    """
+    if not due_date:
+        return None
+    time_zone = pytz.timezone(app.config['COURSE_TIME_ZONE'])
+    return time_zone.localize(due_date).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def parse_due_date(nb, default=None):
+    """Return the due date from the first few markdown cells of an assignment notebook, or None."""
+    if not nb or not nb.cells:
+        return
+
+    m = next((m
+              for m in (re.search(r'Due:?\s*(.+)', cell.source, re.I)
+                        for cell in takewhile(lambda c: c.cell_type == 'markdown', nb.cells[:5]))
+              if m),
+             None)
+    if not m:
+        return
+
+    # prepare the date for dateutil.parse, which doesn't know "noon"
+    s = m.group(1)
+    s = re.sub(r'(12(:00)?)? ?noon', '12:00PM', s)
+    s = re.sub(r'~~.*?~~', '', s)
+    s = re.sub(r'\*', '', s)
+    # TODO parse relative to timezone
+    try:
+        return dateutil.parser.parse(s, fuzzy=True, default=default)
+    except ValueError:
+        return
+
+
+def read_question_names(nb) -> List[str]:
+    """Return the names of the questions in an assignment notebook, in the order that the collator reports them."""
+    from nbcollate import NotebookCollator
+    if not nb:
+        return []
+    return [question_name for question_name, _ in NotebookCollator(nb, {}).report_missing_answers()]
+
+
+def update_assignment_metadata(assignment_repo: Repo):
+    """Update the assignments of a source repo from its notebook files.
+
+    Each assignment's name, due date, and questions are extracted from its notebook, unless they were already
+    extracted from the same version of the file.
+    """
+    assignment_paths = {f.path for f in assignment_repo.files if f.path.endswith('.ipynb')}
+    update_assignment_file_list(assignment_repo, assignment_paths)
+
+    assignments = (session.query(Assignment)
+                   .options(joinedload(Assignment.file))
+                   .options(joinedload(Assignment.questions))
+                   .filter(Assignment.repo_id == assignment_repo.id)
+                   .all())
+    assignments = [assignment for assignment in assignments
+                   if assignment.file and assignment.metadata_sha != assignment.file.sha]
+    if not assignments:
+        return
+
+    print("Reading metadata from %d assignment(s)" % len(assignments))
+    load_assignment_contents(assignments)
+    for assignment in assignments:
+        nb = assignment.notebook
+        assignment.name = compute_assignment_name(assignment.path)
+        assignment.due_date = parse_due_date(nb, default=assignment.file.mod_time)
+        update_assignment_questions(assignment, read_question_names(nb))
+        assignment.metadata_sha = assignment.file.sha
+    session.commit()
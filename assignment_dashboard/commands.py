@@ -2,14 +2,15 @@ import os
 import sys
 
 import click
-from alembic import command
-from alembic.config import Config
 
-from . import app, update_database
+from . import app
 from .database import db, session
 from .model_helpers import update_names_from_csv
 from .models import Assignment, Repo, User
 
+# The commands import modules that are slow to load, or that read the environment when they're loaded, when they run;
+# so that each command, and the web app, only load what they use.
+
 
 def assert_github_token():
     token_name = 'GITHUB_API_TOKEN'
@@ -23,6 +24,8 @@ def assert_github_token():
 @app.cli.command()
 def initdb():
     """Initialize the database."""
+    from alembic import command
+    from alembic.config import Config
     db.drop_all()
     db.create_all()
     alembic_cfg = Config(os.path.join(os.path.dirname(__file__), "../migrations/alembic.ini"))
@@ -40,18 +43,24 @@ def clear_cache():
 def add_repo(repo_name):
     """Add a repository to the database."""
     assert_github_token()
-    update_database.epo(repo_name)
+    from .update_database import add_repo
+    add_repo(repo_name)
 
 
 @app.cli.command()
 @click.option('--repo-limit', type=click.INT, help="Limit the number of repos.")
 @click.option('--commit-limit', type=click.INT, help="Limit the number of commits.")
 @click.option('--reprocess', is_flag=True, help="Reprocess previously-seen commits")
+@click.option('--commit-history', is_flag=True, help="Read each new commit, to record every version of each file")
 @click.option('--oldest-first', is_flag=True, help="Oldest repos first")
+@click.option('--scheduled', is_flag=True, help="Only repos that are due for a refresh, stalest first")
 @click.option('--users', help="Restrict to logins in this comma-separated list")
 @click.option('--update-users/--skip-update-users', default=True, help="Update user list")
+@click.option('--processes', type=click.INT, help="Update this many assignment repos in parallel. Defaults to $UPDATEDB_PROCESSES.")
 def updatedb(**options):
     """Update the database from GitHub."""
+    from alembic import command
+    from alembic.config import Config
     alembic_cfg = Config(os.path.join(os.path.dirname(__file__), "../migrations/alembic.ini"))
     command.upgrade(alembic_cfg, "head")
 
@@ -67,11 +76,53 @@ def updatedb(**options):
         sys.exit(1)
 
     # do the import after the environs have been set
+    from . import update_database
     if options['users']:
         options['users'] = list(filter(None, options['users'].split(',')))
-    for repo in repos:
-        print("Updating %s" % repo.full_name)
-        update_database.update_db(repo.full_name, options)
+    processes = options.pop('processes') or app.config['UPDATEDB_PROCESSES']
+    failures = update_database.update_source_repos([repo.full_name for repo in repos], options, processes=processes)
+    if failures:
+        sys.stderr.write("Error: failed to update %s\n" % ', '.join(failures))
+        sys.exit(1)
+
+
+@app.cli.command()
+@click.option('--snapshot-dir', type=click.Path(file_okay=False), help="Defaults to $SNAPSHOT_DIR.")
+def publish(snapshot_dir):
+    """Publish static snapshots of the dashboard."""
+    from .snapshots import publish_snapshots
+    version_dir = publish_snapshots(snapshot_dir)
+    click.echo("Published %s" % version_dir)
+
+
+@app.cli.command()
+@click.option('--strip-outputs', is_flag=True, help="Discard the cell outputs. Defaults to $STRIP_NOTEBOOK_OUTPUTS.")
+@click.option('--restore', is_flag=True, help="Convert notebooks that are stored as cells back to whole files")
+def store_notebook_cells(strip_outputs, restore):
+    """Convert stored notebooks to cell storage."""
+    from .notebook_store import restore_notebook_files, store_notebook_cells
+    if restore:
+        click.echo("Restored %d notebook file(s)." % restore_notebook_files())
+    else:
+        count = store_notebook_cells(strip_outputs=strip_outputs or app.config['STRIP_NOTEBOOK_OUTPUTS'])
+        click.echo("Converted %d notebook file(s) to cells." % count)
+
+
+@app.cli.command()
+@click.option('--batch-size', type=click.INT, default=200, help="The number of rows to delete per transaction.")
+@click.option('--dry-run', is_flag=True, help="Report what would be deleted, without deleting it")
+@click.option('--vacuum', is_flag=True, help="Return the freed space to the file system. This locks a SQLite database.")
+def gc(batch_size, dry_run, vacuum):
+    """Delete unreferenced file contents, and old commits and revisions."""
+    from .retention import collect_garbage, vacuum_database
+    if dry_run:
+        click.echo("Dry run; the database is unchanged.")
+    for description, count, size in collect_garbage(batch_size=batch_size, dry_run=dry_run):
+        click.echo("%s: %d%s" % (description.capitalize(), count, " (%.1f MB)" % (size / 1e6) if size is not None else ''))
+    if vacuum and not dry_run:
+        freed = vacuum_database()
+        if freed is not None:
+            click.echo("Vacuumed the database: %.1f MB freed" % (freed / 1e6))
 
 
 @app.cli.command()
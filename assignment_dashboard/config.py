@@ -11,8 +11,59 @@ class BaseConfig(object):
     SQLALCHEMY_ECHO = True if os.environ.get('SQLALCHEMY_ECHO') else False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # If the database is SQLite, each connection sets these. Write-ahead logging lets the web app read while the
+    # database updater writes. SQLITE_BUSY_TIMEOUT is in milliseconds; SQLITE_CACHE_SIZE is in KiB.
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', 'True') not in ('False', '0')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '30000'))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '20000'))
+
     TZ = os.environ.get('TZ', 'US/Eastern')
 
+    # The time zone of the due dates in assignment notebooks. Commit and file times are stored in UTC, and due dates are
+    # converted to UTC before they're compared with them.
+    COURSE_TIME_ZONE = os.environ.get('COURSE_TIME_ZONE', TZ)
+
+    # The number of worker processes that read student notebooks during collation. 0 reads them in the web process.
+    COLLATION_PROCESSES = int(os.environ.get('COLLATION_PROCESSES', '0'))
+
+    # Display collated notebooks one question at a time, loading each question as it's scrolled into view
+    PAGED_COLLATION = os.environ.get('PAGED_COLLATION', 'False') not in ('False', '0')
+
+    # `flask publish` renders static snapshots of the dashboard here, for nginx to serve
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR',
+                                  os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/snapshots')))
+
+    # Assignment repos with more students than this display their dashboard as a virtualized grid, that the browser
+    # renders from the /api/v1 response data, instead of as a server-rendered table
+    VIRTUAL_GRID_THRESHOLD = int(os.environ.get('VIRTUAL_GRID_THRESHOLD', '100'))
+
+    # Store downloaded notebooks as lists of cells that are shared between notebooks, instead of as whole files. If
+    # STRIP_NOTEBOOK_OUTPUTS is also set, the cells' outputs are discarded instead of being stored.
+    NOTEBOOK_CELL_STORAGE = os.environ.get('NOTEBOOK_CELL_STORAGE', 'False') not in ('False', '0')
+    STRIP_NOTEBOOK_OUTPUTS = os.environ.get('STRIP_NOTEBOOK_OUTPUTS', 'False') not in ('False', '0')
+
+    # The retention policy that `flask gc` applies. Commits are deleted after COMMIT_RETENTION_DAYS; file revisions
+    # that a later revision supersedes are deleted after FILE_REVISION_RETENTION_DAYS; forks that haven't been
+    # refreshed in FORK_ARCHIVE_DAYS are marked inactive. 0 disables each of these. File contents and notebook cells
+    # that nothing refers to are deleted once the database updater hasn't used them for GC_GRACE_HOURS.
+    COMMIT_RETENTION_DAYS = int(os.environ.get('COMMIT_RETENTION_DAYS', '365'))
+    FILE_REVISION_RETENTION_DAYS = int(os.environ.get('FILE_REVISION_RETENTION_DAYS', '0'))
+    FORK_ARCHIVE_DAYS = int(os.environ.get('FORK_ARCHIVE_DAYS', '90'))
+    GC_GRACE_HOURS = int(os.environ.get('GC_GRACE_HOURS', '24'))
+
+    # The number of processes that `flask updatedb` updates assignment repos (and their forks) in. An updater claims
+    # each repo for REPO_LEASE_MINUTES before it refreshes it, and renews the claim as it goes; another updater can
+    # take over a claim that has expired.
+    UPDATEDB_PROCESSES = int(os.environ.get('UPDATEDB_PROCESSES', '1'))
+    REPO_LEASE_MINUTES = int(os.environ.get('REPO_LEASE_MINUTES', '15'))
+
+    # The number of seconds to cache the ids of the repos and assignments that a user can access, and the signed-in
+    # user's id, login, and avatar
+    ACCESS_INDEX_TIMEOUT = int(os.environ.get('ACCESS_INDEX_TIMEOUT', '300'))
+    # Without REDIS_HOST, each process has its own cache, which `flask updatedb` can't invalidate when memberships
+    # change; these are then cached for at most this many seconds instead
+    LOCAL_ACCESS_INDEX_TIMEOUT = int(os.environ.get('LOCAL_ACCESS_INDEX_TIMEOUT', '30'))
+
     if 'GITHUB_CLIENT_ID' in os.environ:
         REQUIRE_LOGIN = True
         GITHUB_CLIENT_ID = os.environ['GITHUB_CLIENT_ID']
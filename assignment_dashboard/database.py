@@ -1,5 +1,9 @@
+import sqlite3
+
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from . import app
 
@@ -9,3 +13,21 @@ migrate = Migrate(app, db)
 # for re-export
 session = db.session
 Base = db.Model
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configure each SQLite connection for concurrent access by the web app and the database updater.
+
+    In WAL mode, readers don't wait for a writer, and a writer doesn't wait for readers. A writer waits up to
+    SQLITE_BUSY_TIMEOUT for another writer, instead of failing with "database is locked".
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if app.config['SQLITE_WAL']:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')  # durable at checkpoints, which is safe in WAL mode
+    cursor.execute('PRAGMA busy_timeout=%d' % app.config['SQLITE_BUSY_TIMEOUT'])
+    cursor.execute('PRAGMA cache_size=%d' % -app.config['SQLITE_CACHE_SIZE'])
+    cursor.close()
@@ -4,8 +4,7 @@ from typing import Callable
 from flask import abort, g, redirect, request, url_for
 
 from . import app
-from .models import Assignment
-from .viewmodel import get_source_repos
+from .access import get_access_index
 
 
 def login_required(f: Callable):
@@ -56,8 +55,10 @@ def user_has_access(user, model_name: str, object_id: int) -> bool:
     Note:
         This function is used as a helper for `requires_access`on
     """
-    if model_name == 'assignment':
-        assignment = Assignment.query.get(object_id)
-        model_name, object_id = 'repo', assignment.repo_id
-    assert model_name == 'repo'
-    return object_id in [repo.id for repo in get_source_repos(user)]
+    assert model_name in ('assignment', 'repo')
+
+    def contains(index):
+        return object_id in (index.assignment_ids if model_name == 'assignment' else index.repo_ids)
+
+    # The cached index may predate a newly added repo or assignment; refresh it before denying access.
+    return contains(get_access_index(user.id)) or contains(get_access_index(user.id, refresh=True))
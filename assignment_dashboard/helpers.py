@@ -1,5 +1,7 @@
+import csv
 import re
-from typing import Tuple
+import zlib
+from typing import Iterable, Iterator, Tuple
 
 
 def lexituples(s: str) -> Tuple[str]:
@@ -7,3 +9,35 @@ def lexituples(s: str) -> Tuple[str]:
     return tuple(int(s) if re.match(r'\d+', s) else s
                  for s in re.split(r'(\d+)', s)
                  if s)
+
+
+def iter_chunks(s: str, chunk_size=64 * 1024) -> Iterator[str]:
+    """Yield successive `chunk_size` slices of `s`."""
+    for i in range(0, len(s), chunk_size):
+        yield s[i:i + chunk_size]
+
+
+def gzip_chunks(chunks: Iterable, level=6) -> Iterator[bytes]:
+    """Yield the gzip-compressed content of a sequence of strings or bytes, compressing it incrementally."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16 + MAX_WBITS selects the gzip format
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _LineWriter(object):
+    """A file-like object whose write method returns its argument, so that csv.writer.writerow returns the line."""
+
+    def write(self, s):
+        return s
+
+
+def iter_csv_lines(rows: Iterable[Iterable]) -> Iterator[str]:
+    """Yield the lines of a CSV file with the specified rows, one at a time."""
+    writer = csv.writer(_LineWriter())
+    for row in rows:
+        yield writer.writerow(row)
@@ -0,0 +1,95 @@
+"""Leases that keep database updaters from refreshing the same repo at the same time.
+
+`flask updatedb` can update several assignment repos in parallel processes (UPDATEDB_PROCESSES), and cron runs, or
+several worker containers, can overlap. Before an updater refreshes a repo, it claims the repo's RepoLease row, with
+its owner (host name and process id) and an expiry time REPO_LEASE_MINUTES later. The updater renews the lease as it
+works, and deletes it when it's done. Another updater skips the repo while the lease is held. If an updater dies, its
+leases expire, and the next updater to claim the repo takes them over.
+
+Claims are single UPDATE or INSERT statements, so that two updaters can't both succeed. Expiry times are compared
+with each host's clock, which REPO_LEASE_MINUTES should exceed any skew between.
+"""
+
+import os
+import socket
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from .app import app
+from .database import session
+from .models import RepoLease
+
+
+def get_lease_owner() -> str:
+    """Return the owner name of this process's leases."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def get_lease_expiry(now: datetime) -> datetime:
+    return now + timedelta(minutes=app.config['REPO_LEASE_MINUTES'])
+
+
+def acquire_lease(repo_id: int) -> bool:
+    """Claim repo_id for this process. Returns false if another updater holds an unexpired lease on it.
+
+    This commits the session.
+    """
+    owner = get_lease_owner()
+    now = datetime.utcnow()
+    claimed = (session.query(RepoLease)
+               .filter(RepoLease.repo_id == repo_id)
+               .filter(or_(RepoLease.owner == owner, RepoLease.expires_at < now))
+               .update({RepoLease.owner: owner, RepoLease.expires_at: get_lease_expiry(now)},
+                       synchronize_session=False))
+    if not claimed:
+        session.add(RepoLease(repo_id=repo_id, owner=owner, expires_at=get_lease_expiry(now)))
+    try:
+        session.commit()
+    except IntegrityError:
+        # another updater holds the lease, or inserted it first
+        session.rollback()
+        return False
+    return True
+
+
+def renew_lease(repo_id: int) -> bool:
+    """Extend this process's lease on repo_id. Returns false if the lease expired and another updater took it over.
+
+    This commits the session.
+    """
+    renewed = (session.query(RepoLease)
+               .filter(RepoLease.repo_id == repo_id)
+               .filter(RepoLease.owner == get_lease_owner())
+               .update({RepoLease.expires_at: get_lease_expiry(datetime.utcnow())}, synchronize_session=False))
+    session.commit()
+    return bool(renewed)
+
+
+def release_lease(repo_id: int):
+    """Delete this process's lease on repo_id, if it holds one. This commits the session."""
+    (session.query(RepoLease)
+     .filter(RepoLease.repo_id == repo_id)
+     .filter(RepoLease.owner == get_lease_owner())
+     .delete(synchronize_session=False))
+    session.commit()
+
+
+@contextmanager
+def repo_lease(repo_id: int) -> Iterator[bool]:
+    """Claim repo_id for the duration of the block. The block receives whether the claim succeeded.
+
+    If the block raises an exception, its uncommitted changes are rolled back before the lease is released.
+    """
+    acquired = acquire_lease(repo_id)
+    try:
+        yield acquired
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if acquired:
+            release_lease(repo_id)
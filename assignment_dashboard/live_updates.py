@@ -0,0 +1,88 @@
+"""Publish changes to student responses over Redis, for live updates to the assignment repo dashboard.
+
+The database updater publishes a message for each assignment file that it records for a student fork. The web app
+relays the messages for an assignment repo to the browsers that are displaying its dashboard.
+"""
+
+import json
+from typing import Iterable, Iterator, Optional
+
+import redis
+
+from .app import app
+from .database import session
+from .models import Assignment, FileCommit, FileContent, Repo
+from .viewmodel import get_response_status, update_content_types
+
+KEEPALIVE_INTERVAL = 15  # seconds
+
+
+def get_redis() -> Optional[redis.StrictRedis]:
+    """Return a Redis client, or None if the app isn't configured to use Redis."""
+    host = app.config.get('REDIS_HOST')
+    return redis.StrictRedis(host=host) if host else None
+
+
+def get_response_channel(repo_id: int) -> str:
+    return 'responses/%d' % repo_id
+
+
+def publish_response_updates(repo: Repo, file_commits: Iterable[FileCommit]):
+    """Publish a message for each of file_commits that is a response to an assignment of repo's source repo.
+
+    Each message is a JSON object with the student and assignment ids, the response status, and its timestamp.
+    This does nothing if repo isn't a fork, or if Redis isn't configured.
+    """
+    client = get_redis()
+    if not client or not repo.source_id:
+        return
+
+    # keep the most recent commit to each path
+    file_commits = {fc.path: fc for fc in sorted(file_commits, key=lambda fc: fc.mod_time)}
+    assignments = (session.query(Assignment)
+                   .filter(Assignment.repo_id == repo.source_id)
+                   .filter(Assignment.path.in_(file_commits.keys() or [None]))
+                   .all())
+    if not assignments:
+        return
+
+    assignment_file_shas = {sha for sha, in session.query(FileCommit.sha).filter(FileCommit.repo_id == repo.source_id)}
+    file_contents = {fc.sha: fc
+                     for fc in (session.query(FileContent)
+                                .filter(FileContent.sha.in_(file_commits[a.path].sha for a in assignments)))}
+    update_content_types(file_contents.values())
+    session.commit()
+
+    channel = get_response_channel(repo.source_id)
+    for assignment in assignments:
+        fc = file_commits[assignment.path]
+        file_content = file_contents.get(fc.sha)
+        content_type = file_content.content_type if file_content else None
+        message = dict(student=repo.owner_id,
+                       assignment=assignment.id,
+                       status=get_response_status(fc.sha, content_type, assignment_file_shas),
+                       timestamp=fc.mod_time.isoformat())
+        client.publish(channel, json.dumps(message))
+
+
+def subscribe_response_updates(repo_id: int) -> Optional[Iterator[Optional[dict]]]:
+    """Return an iterator over the messages published for repo_id, or None if Redis isn't configured.
+
+    The iterator yields None every KEEPALIVE_INTERVAL seconds that a message doesn't arrive, so that the caller can
+    detect a disconnected client.
+    """
+    client = get_redis()
+    if not client:
+        return None
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(get_response_channel(repo_id))
+
+    def messages():
+        try:
+            while True:
+                message = pubsub.get_message(timeout=KEEPALIVE_INTERVAL)
+                yield json.loads(message['data'].decode()) if message else None
+        finally:
+            pubsub.close()
+
+    return messages()
@@ -1,8 +1,6 @@
 import re
 from collections import defaultdict
 
-import pandas as pd
-
 from .database import session
 from .models import User
 
@@ -13,6 +11,7 @@ class InvalidInput(Exception):
 
 
 def update_names_from_csv(csv_path):
+    import pandas as pd  # imported here, so that the web app only loads pandas if this function is called
     df = pd.DataFrame.from_csv(csv_path, index_col=None)
     name_col = next((col for col in df.columns if re.match(r'(user ?)?names?', col, re.I)), None)
     github_col = next((col for col in df.columns if re.search(r'git', col, re.I)), None)
@@ -1,11 +1,13 @@
 import os
+from datetime import datetime
+from typing import List, Mapping
 
-from sqlalchemy import (Boolean, CheckConstraint, Column, DateTime, Enum, ForeignKey, Integer, String, Table, Text,
-                        UniqueConstraint)
+from sqlalchemy import (DDL, Boolean, CheckConstraint, Column, DateTime, Enum, ForeignKey, Index, Integer, LargeBinary,
+                        String, Table, Text, UniqueConstraint, event)
 from sqlalchemy.orm import backref, deferred, relationship
 
 from .database import Base
-from .nb_helpers import safe_read_notebook
+from .nb_helpers import join_notebook_cells, safe_read_notebook
 
 DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 MD5_HASH_CONSTRAINT = CheckConstraint('length(md5) = 32')
@@ -41,29 +43,104 @@ Base.__repr__ = base__repr__
 
 class FileCommit(Base):
     __tablename__ = 'file_commit'
-    __table_args__ = (UniqueConstraint('repo_id', 'path'),)
+    __table_args__ = (UniqueConstraint('repo_id', 'path'),
+                      Index('ix_file_commit_path_repo_id', 'path', 'repo_id'),  # an assignment's files
+                      Index('ix_file_commit_repo_id_mod_time', 'repo_id', 'mod_time'),  # a repo's latest file
+                      )
 
     id = Column(Integer, primary_key=True)
     repo_id = Column(Integer, ForeignKey('repo.id'), nullable=False, index=True)
     path = Column(String(1024), nullable=False)
     mod_time = Column(DateTime, nullable=False)  # de-normalized from the related commit
-    sha = Column(String(40), ForeignKey('file_content.sha'), SHA_HASH_CONSTRAINT, nullable=False)
+    sha = Column(String(40), ForeignKey('file_content.sha'), SHA_HASH_CONSTRAINT, nullable=False, index=True)
+    updated_at = Column(DateTime, nullable=True)  # when the updater recorded this version; the API's `since` uses this
 
     file_content = relationship('FileContent', backref='files', lazy='joined')
     repo = relationship('Repo', backref='files')
 
     @property
     def content(self):
-        return self.file_content.content
+        return self.file_content.read()
+
+
+class FileRevision(Base):
+    """A version of a file in a repo. Unlike FileCommit, which records the latest version, this table is append-only."""
+
+    __tablename__ = 'file_revision'
+    __table_args__ = (Index('ix_file_revision_repo_id_path_mod_time', 'repo_id', 'path', 'mod_time'),)
+
+    id = Column(Integer, primary_key=True)
+    repo_id = Column(Integer, ForeignKey('repo.id'), nullable=False)
+    path = Column(String(1024), nullable=False)
+    mod_time = Column(DateTime, nullable=False)
+    sha = Column(String(40), ForeignKey('file_content.sha'), SHA_HASH_CONSTRAINT, nullable=False, index=True)
+
+    file_content = relationship('FileContent', lazy='joined')
+    repo = relationship('Repo')
 
 
 class FileContent(Base):
+    """The content of a file.
+
+    A notebook can instead be stored as a list of cells (see notebook_store.py). Its `content` is then None;
+    `notebook_data` holds its fields other than its cells, and `cells` the positions of its cells.
+    """
+
     __tablename__ = 'file_content'
 
     id = Column(Integer, primary_key=True)
     sha = Column(String(40), SHA_HASH_CONSTRAINT, nullable=False, index=True, unique=True)
     content_type = Column(String(40), nullable=True)
     content = deferred(Column(Text, nullable=True))
+    notebook_data = deferred(Column(Text, nullable=True))
+    seen_at = Column(DateTime, default=datetime.utcnow)  # when the database updater last referred to this; see retention.py
+
+    cells = relationship('FileContentCell', order_by='FileContentCell.position', cascade='all, delete-orphan')
+
+    def read(self):
+        """Return the file's content, reassembling it from its cells if it's stored as cells."""
+        if self.notebook_data is None:
+            return self.content
+        return join_notebook_cells(self.notebook_data,
+                                   [(ref.cell.cell_data, ref.outputs.outputs_data if ref.outputs else None)
+                                    for ref in self.cells])
+
+
+class NotebookCell(Base):
+    """A notebook cell, without its outputs. Each distinct cell is stored once, and shared by the notebooks that
+    contain it."""
+
+    __tablename__ = 'notebook_cell'
+
+    id = Column(Integer, primary_key=True)
+    sha = Column(String(40), SHA_HASH_CONSTRAINT, nullable=False, unique=True)  # the sha1 of cell_data
+    cell_data = Column(Text, nullable=False)
+    seen_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CellOutputs(Base):
+    """The outputs and execution count of a code cell."""
+
+    __tablename__ = 'cell_outputs'
+
+    id = Column(Integer, primary_key=True)
+    sha = Column(String(40), SHA_HASH_CONSTRAINT, nullable=False, unique=True)  # the sha1 of outputs_data
+    outputs_data = Column(Text, nullable=False)
+    seen_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FileContentCell(Base):
+    """The cell at a position of a notebook that is stored as cells."""
+
+    __tablename__ = 'file_content_cell'
+
+    file_sha = Column(String(40), ForeignKey('file_content.sha'), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    cell_sha = Column(String(40), ForeignKey('notebook_cell.sha'), nullable=False, index=True)
+    outputs_sha = Column(String(40), ForeignKey('cell_outputs.sha'), nullable=True, index=True)
+
+    cell = relationship('NotebookCell', lazy='joined')
+    outputs = relationship('CellOutputs', lazy='joined')
 
 
 organization_users_table = Table(
@@ -72,6 +149,13 @@ organization_users_table = Table(
 )
 
 
+# A commit is stored once, and shared by the source repo and the forks that contain it
+repo_commits_table = Table(
+    'repo_commits', Base.metadata, Column('repo_id', ForeignKey('repo.id'), primary_key=True),
+    Column('commit_id', ForeignKey('commit.id'), primary_key=True),
+)
+
+
 class User(Base):
     __tablename__ = 'user'
 
@@ -103,7 +187,9 @@ class User(Base):
 
 class Repo(Base):
     __tablename__ = 'repo'
-    __table_args__ = (UniqueConstraint('owner_id', 'name'),)
+    __table_args__ = (UniqueConstraint('owner_id', 'name'),
+                      Index('ix_repo_source_id_refreshed_at', 'source_id', 'refreshed_at'),  # forks, by refresh time
+                      )
 
     id = Column(Integer, primary_key=True)
     owner_id = Column(Integer, ForeignKey('user.id'), nullable=False)
@@ -111,10 +197,11 @@ class Repo(Base):
     name = Column(String(100), nullable=False)
     is_active = Column(Boolean, nullable=False, server_default='1')
     refreshed_at = Column(DateTime)
+    head_sha = Column(String(40))  # the default branch's head, as of refreshed_at
 
     source = relationship('Repo', remote_side=[id])
     forks = relationship('Repo')
-    commits = relationship('Commit', backref='repo')
+    commits = relationship('Commit', secondary=repo_commits_table, backref='repos')
     owner = relationship('User', lazy='joined')
 
     @property
@@ -134,13 +221,21 @@ class Repo(Base):
         return not self.source_id
 
 
+class RepoLease(Base):
+    """A database updater's claim to refresh a repo, until expires_at (see leases.py)."""
+
+    __tablename__ = 'repo_lease'
+
+    repo_id = Column(Integer, ForeignKey('repo.id'), primary_key=True)
+    owner = Column(String(100), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
 class Commit(Base):
     __tablename__ = 'commit'
-    __table_args__ = (UniqueConstraint('repo_id', 'sha'),)
 
     id = Column(Integer, primary_key=True)
-    repo_id = Column(Integer, ForeignKey('repo.id'), nullable=False, index=True)
-    sha = Column(String(40), SHA_HASH_CONSTRAINT, nullable=False, index=True)
+    sha = Column(String(40), SHA_HASH_CONSTRAINT, nullable=False, index=True, unique=True)
     commit_date = Column(DateTime, nullable=False)
 
 
@@ -160,20 +255,16 @@ class Assignment(Base):
     nb_content = deferred(Column(Text, nullable=True))
     md5 = Column(String(32), MD5_HASH_CONSTRAINT, nullable=True)
     due_date = Column(DateTime)
+    metadata_sha = Column(String(40), nullable=True)  # the sha of the file that name, due_date, questions are read from
 
     repo = relationship('Repo', backref=backref('assignments', cascade='all, delete-orphan'))
-    # file = relationship('FileContent',
-    #                     primaryjoin=and_(Assignment.repo_id == FileCommit.repo_id, Assignment.path == FileCommit.path),
-    #                     foreign_keys=[repo_id, path])
-
-    @property
-    def file(self):
-        # TODO get `file` relationship above working; replace this query by
-        # that
-        return (self.query.session.query(FileCommit)
-                .filter(FileCommit.repo_id == self.repo_id)
-                .filter(FileCommit.path == self.path)
-                .one())
+    # The source repo's FileCommit for this assignment. Use joinedload(Assignment.file) to load it for a list of
+    # assignments with a single query.
+    file = relationship('FileCommit',
+                        primaryjoin='and_(Assignment.repo_id == foreign(FileCommit.repo_id), '
+                                    'Assignment.path == foreign(FileCommit.path))',
+                        uselist=False,
+                        viewonly=True)
 
     @property
     def content(self):
@@ -202,15 +293,99 @@ class AssignmentQuestion(Base):
     assignment = relationship('Assignment', backref=backref('questions', cascade='all, delete-orphan'))
 
 
-class AssignmentQuestionResponse(Base):
-    __tablename__ = 'assignment_question_response'
-    __table_args__ = (UniqueConstraint('assignment_question_id', 'user_id'),)
+class AssignmentAnswerStatus(Base):
+    """The answer status of each student, for each question of an assignment.
+
+    The statuses are packed into a single row per assignment: `statuses` is a questions × students matrix of one-byte
+    codes, in row-major order; `user_ids` are the students' ids, in column order, as little-endian int32s; and
+    `status_names` is the newline-separated list of status names that the codes index. Code 0 means that the student
+    has no status for that question.
+    """
+
+    __tablename__ = 'assignment_answer_status'
 
     id = Column(Integer, primary_key=True)
-    assignment_question_id = Column(Integer, ForeignKey('assignment_question.id'), nullable=False)
-    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
-    status = Column(String(20))
-    notebook_data = deferred(Column(Text, nullable=True))
+    assignment_id = Column(Integer, ForeignKey('assignment.id'), nullable=False, unique=True)
+    user_ids_data = Column('user_ids', LargeBinary, nullable=False)
+    status_names_data = Column('status_names', Text, nullable=False)
+    statuses_data = Column('statuses', LargeBinary, nullable=False)
+
+    assignment = relationship('Assignment',
+                              backref=backref('answer_status', uselist=False, cascade='all, delete-orphan'))
+
+    USER_ID_DTYPE = '<i4'
+    STATUS_DTYPE = 'u1'
+
+    @classmethod
+    def pack_statuses(cls, user_ids: List[int], question_statuses: List[Mapping[int, str]]) -> Mapping:
+        """Return the column values for a list of user ids, and a list with a dict of user_id -> status per question."""
+        import numpy as np
+        status_names = [''] + sorted({status for d in question_statuses for status in d.values()})
+        assert len(status_names) <= 256, "too many distinct statuses to pack into a byte"
+        codes = {name: i for i, name in enumerate(status_names)}
+        matrix = np.array([[codes[d.get(user_id, '')] for user_id in user_ids] for d in question_statuses],
+                          dtype=cls.STATUS_DTYPE)
+        return dict(user_ids_data=np.array(user_ids, dtype=cls.USER_ID_DTYPE).tobytes(),
+                    status_names_data='\n'.join(status_names),
+                    statuses_data=matrix.tobytes())
 
-    question = relationship('AssignmentQuestion', backref=backref('responses', cascade='all, delete-orphan'))
-    user = relationship('User', lazy='joined')
+    @property
+    def user_ids(self):
+        import numpy as np
+        return np.frombuffer(self.user_ids_data, dtype=self.USER_ID_DTYPE)
+
+    @property
+    def status_names(self) -> List[str]:
+        return self.status_names_data.split('\n')
+
+    @property
+    def matrix(self):
+        """Return the questions × students matrix of status codes."""
+        import numpy as np
+        statuses = np.frombuffer(self.statuses_data, dtype=self.STATUS_DTYPE)
+        student_count = len(self.user_ids)
+        return statuses.reshape(len(statuses) // student_count if student_count else 0, student_count)
+
+    def status_code(self, status_name: str) -> int:
+        """Return the code for status_name, or -1 if no cell has that status."""
+        names = self.status_names
+        return names.index(status_name) if status_name in names else -1
+
+
+class AnswerCell(Base):
+    """A cell of a student's response to an assignment, that isn't in the assignment notebook.
+
+    These rows are the documents of the full-text answer search (see answer_search.py). `position` is the position of
+    the AssignmentQuestion whose section contains the cell.
+    """
+
+    __tablename__ = 'answer_cell'
+    __table_args__ = (Index('ix_answer_cell_assignment_id_user_id', 'assignment_id', 'user_id'),)
+
+    id = Column(Integer, primary_key=True)
+    assignment_id = Column(Integer, ForeignKey('assignment.id'), nullable=False)
+    position = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    source = Column(Text, nullable=False)
+
+    assignment = relationship('Assignment', backref=backref('answer_cells', cascade='all, delete-orphan'))
+    user = relationship('User')
+
+
+# The full-text index of AnswerCell.source. On SQLite this is an external-content FTS5 table, which triggers keep in
+# sync with answer_cell. On PostgreSQL it's a GIN index on the cells' tsvector. These are also created by migration
+# 9a4e6b2d7c13.
+for statement in [
+        "CREATE VIRTUAL TABLE answer_cell_fts USING fts5(source, content='answer_cell', content_rowid='id')",
+        "CREATE TRIGGER answer_cell_ai AFTER INSERT ON answer_cell BEGIN "
+        "INSERT INTO answer_cell_fts(rowid, source) VALUES (new.id, new.source); END",
+        "CREATE TRIGGER answer_cell_ad AFTER DELETE ON answer_cell BEGIN "
+        "INSERT INTO answer_cell_fts(answer_cell_fts, rowid, source) VALUES ('delete', old.id, old.source); END",
+        "CREATE TRIGGER answer_cell_au AFTER UPDATE ON answer_cell BEGIN "
+        "INSERT INTO answer_cell_fts(answer_cell_fts, rowid, source) VALUES ('delete', old.id, old.source); "
+        "INSERT INTO answer_cell_fts(rowid, source) VALUES (new.id, new.source); END"]:
+    event.listen(AnswerCell.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(AnswerCell.__table__, 'after_drop', DDL("DROP TABLE IF EXISTS answer_cell_fts").execute_if(dialect='sqlite'))
+event.listen(AnswerCell.__table__, 'after_create',
+             DDL("CREATE INDEX ix_answer_cell_source_tsv ON answer_cell "
+                 "USING gin (to_tsvector('english', source))").execute_if(dialect='postgresql'))
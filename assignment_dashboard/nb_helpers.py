@@ -1,7 +1,10 @@
 # """Jupyter notebook helper functions."""
 
-
-import nbformat
+import hashlib
+import json
+import multiprocessing
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from .globals import NBFORMAT_VERSION
 
@@ -12,7 +15,134 @@ def safe_read_notebook(p, as_version=NBFORMAT_VERSION):
     Unlike `nbformat.reads (which this wraps)`, this function returns None
     if `string` is not a valid notebook.
     """
+    import nbformat
     try:
         return nbformat.reads(p, as_version=as_version)
     except nbformat.reader.NotJSONError:
         return None
+
+
+def nb_clear_outputs(nb):
+    """Clear the output cells from a Jupyter notebook."""
+    for cell in nb.cells:
+        if 'outputs' in cell:
+            cell['outputs'] = []
+        if 'execution_count' in cell:
+            cell['execution_count'] = None
+
+
+def split_notebook_sections(nb, headings: List[str]) -> List:
+    """Split a notebook into a list of notebooks, one for each of headings.
+
+    Each section begins at the first cell after the start of the previous section whose source contains its heading,
+    and continues until the start of the next section that was found. A heading that isn't found yields an empty
+    notebook. Cells that precede the first section are included in that section.
+    """
+    import nbformat
+    starts = []
+    i = 0
+    for heading in headings:
+        heading = (heading or '').strip()
+        start = next((j for j in range(i, len(nb.cells)) if heading and heading in nb.cells[j].source), None)
+        starts.append(start)
+        if start is not None:
+            i = start + 1
+
+    first_start = next((j for j in starts if j is not None), None)
+    sections = []
+    for k, start in enumerate(starts):
+        cells = []
+        if start is not None:
+            end = next((j for j in starts[k + 1:] if j is not None), len(nb.cells))
+            cells = nb.cells[0 if start == first_start else start:end]
+        sections.append(nbformat.v4.new_notebook(cells=cells, metadata=nb.metadata))
+    return sections
+
+
+def read_submission_notebook(content):
+    """Decode and parse a notebook file's content, for collation.
+
+    The outputs are cleared, since the collation doesn't use them; this keeps the result small, so that it's cheap to
+    retain, and to send back from a worker process.
+
+    Returns None if `content` is empty, or is not a valid notebook.
+    """
+    if not content:
+        return None
+    if isinstance(content, bytes):
+        content = content.decode()
+    nb = safe_read_notebook(content)
+    if nb:
+        nb_clear_outputs(nb)
+    return nb
+
+
+def read_submission_notebooks(items: Iterable[Tuple], processes=0, batch_size=None) -> Iterator[Tuple]:
+    """Yield (key, notebook) for each (key, content) in items.
+
+    If processes > 1, the notebooks are read by a pool of that many worker processes. Items are sent to the pool in
+    batches of `batch_size` (by default, a few per process), so that at most one batch of file contents is in flight
+    at a time regardless of the length of `items`.
+    """
+    if processes <= 1:
+        for key, content in items:
+            yield key, read_submission_notebook(content)
+        return
+
+    batch_size = batch_size or 4 * processes
+    items = iter(items)
+    with multiprocessing.Pool(processes) as pool:
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+            keys, contents = zip(*batch)
+            yield from zip(keys, pool.map(read_submission_notebook, contents, chunksize=1))
+
+
+def json_sha(data: str) -> str:
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def split_notebook_cells(content, strip_outputs=False) -> Optional[Tuple[str, List[Tuple[str, Optional[str]]]]]:
+    """Split a notebook file into the JSON of its fields other than its cells, and a list of the JSON of each cell.
+
+    Each item of the list is a tuple of the cell without its outputs, and of its outputs and execution count (or
+    None, if the cell has neither, or if strip_outputs is true).
+
+    Returns None if `content` isn't an nbformat 4 notebook.
+    """
+    if isinstance(content, bytes):
+        content = content.decode()
+    try:
+        nb = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(nb, dict) or not isinstance(nb.get('cells'), list) or nb.get('nbformat') != 4:
+        return None
+    cells = []
+    for cell in nb.pop('cells'):
+        outputs = None
+        if cell.get('cell_type') == 'code':
+            outputs = dict(execution_count=cell.pop('execution_count', None), outputs=cell.pop('outputs', []))
+            if strip_outputs or (outputs['execution_count'] is None and not outputs['outputs']):
+                outputs = None
+        cells.append((json.dumps(cell, sort_keys=True),
+                      json.dumps(outputs, sort_keys=True) if outputs else None))
+    return json.dumps(nb, sort_keys=True), cells
+
+
+def join_notebook_cells(notebook_data: str, cells: Iterable[Tuple[str, Optional[str]]]) -> str:
+    """Reassemble a notebook file from the output of split_notebook_cells.
+
+    This is the inverse of split_notebook_cells, except for stripped outputs. The file is serialized the way that
+    Jupyter writes it, so notebooks that Jupyter wrote are reassembled byte for byte.
+    """
+    nb = json.loads(notebook_data)
+    nb['cells'] = []
+    for cell_data, outputs_data in cells:
+        cell = json.loads(cell_data)
+        if cell.get('cell_type') == 'code':
+            cell.update(json.loads(outputs_data) if outputs_data else dict(execution_count=None, outputs=[]))
+        nb['cells'].append(cell)
+    return json.dumps(nb, sort_keys=True, indent=1, ensure_ascii=False) + '\n'
@@ -0,0 +1,169 @@
+"""Store notebooks as lists of cells that are shared between notebooks.
+
+Student notebooks are mostly copies of the assignment notebook's cells. If NOTEBOOK_CELL_STORAGE is set, the database
+updater stores each notebook that it downloads as its fields other than its cells (FileContent.notebook_data), and an
+ordered list of references (FileContentCell) to content-addressed cells (NotebookCell) and to their outputs
+(CellOutputs). Each distinct cell and output is stored once. If STRIP_NOTEBOOK_OUTPUTS is also set, outputs are
+discarded.
+
+FileContent.read() and iter_file_contents() reassemble the file.
+"""
+
+from collections import defaultdict
+from itertools import islice
+from typing import Iterable, Iterator, List, Mapping, Tuple
+
+from sqlalchemy.orm import undefer
+
+from .app import app
+from .database import session
+from .globals import PYNB_MIME_TYPE
+from .models import CellOutputs, FileContent, FileContentCell, NotebookCell
+from .nb_helpers import join_notebook_cells, json_sha, split_notebook_cells
+from .retention import mark_seen
+
+# The number of shas in each IN clause. SQLite limits a statement to 999 parameters.
+SHA_QUERY_SIZE = 200
+
+# The number of files to read, or to convert, at a time
+FILE_BATCH_SIZE = 20
+
+
+def make_cell_refs(file_sha: str, cells: List[Tuple], new_cells: Mapping, new_outputs: Mapping) -> List[FileContentCell]:
+    """Return the FileContentCells for a list of cells from split_notebook_cells.
+
+    Adds each cell to new_cells, and each output to new_outputs, as sha -> JSON.
+    """
+    refs = []
+    for position, (cell_data, outputs_data) in enumerate(cells):
+        cell_sha = json_sha(cell_data)
+        new_cells[cell_sha] = cell_data
+        outputs_sha = None
+        if outputs_data:
+            outputs_sha = json_sha(outputs_data)
+            new_outputs[outputs_sha] = outputs_data
+        refs.append(FileContentCell(file_sha=file_sha, position=position, cell_sha=cell_sha, outputs_sha=outputs_sha))
+    return refs
+
+
+def add_cells(new_cells: Mapping, new_outputs: Mapping):
+    """Add the cells and outputs, as sha -> JSON, that aren't already in the database to the session."""
+    for model, field, items in [(NotebookCell, 'cell_data', new_cells), (CellOutputs, 'outputs_data', new_outputs)]:
+        shas = list(items)
+        mark_seen(model, shas)  # before checking which exist, so that `flask gc` can't delete them in between
+        saved_shas = set()
+        for i in range(0, len(shas), SHA_QUERY_SIZE):
+            saved_shas |= {sha for sha, in session.query(model.sha).filter(model.sha.in_(shas[i:i + SHA_QUERY_SIZE]))}
+        session.add_all(model(sha=sha, **{field: items[sha]}) for sha in shas if sha not in saved_shas)
+
+
+def add_file_contents(items: Iterable[Tuple]):
+    """Add a FileContent for each (sha, content) in items that isn't already in the database to the session.
+
+    If NOTEBOOK_CELL_STORAGE is set, notebooks are stored as cells. The caller is responsible for committing the
+    session.
+    """
+    cell_storage = app.config['NOTEBOOK_CELL_STORAGE']
+    strip_outputs = app.config['STRIP_NOTEBOOK_OUTPUTS']
+    items = list(items)
+    shas = [sha for sha, _ in items]
+    saved_shas = set()
+    for i in range(0, len(shas), SHA_QUERY_SIZE):
+        saved_shas |= {sha for sha, in session.query(FileContent.sha).filter(FileContent.sha.in_(shas[i:i + SHA_QUERY_SIZE]))}
+    new_cells, new_outputs = {}, {}
+    for sha, content in items:
+        if sha in saved_shas:
+            continue
+        parts = split_notebook_cells(content, strip_outputs=strip_outputs) if cell_storage and content else None
+        if parts is None:
+            session.add(FileContent(sha=sha, content=content))
+            continue
+        notebook_data, cells = parts
+        session.add(FileContent(sha=sha, content_type=PYNB_MIME_TYPE, notebook_data=notebook_data,
+                                cells=make_cell_refs(sha, cells, new_cells, new_outputs)))
+    add_cells(new_cells, new_outputs)
+
+
+def iter_file_contents(shas, include_outputs=True, batch_size=FILE_BATCH_SIZE) -> Iterator[Tuple[str, str]]:
+    """Yield (sha, content) for each FileContent whose sha is in shas, a list or a query.
+
+    Notebooks that are stored as cells are reassembled; if include_outputs is false, without their outputs. Contents
+    are fetched from the database batch_size at a time.
+    """
+    rows = (session.query(FileContent.sha, FileContent.content, FileContent.notebook_data)
+            .filter(FileContent.sha.in_(shas))
+            .yield_per(batch_size))
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        cells = defaultdict(list)
+        cell_shas = [sha for sha, _, notebook_data in batch if notebook_data is not None]
+        if cell_shas:
+            entities = [FileContentCell.file_sha, NotebookCell.cell_data]
+            if include_outputs:
+                entities.append(CellOutputs.outputs_data)
+            query = (session.query(*entities)
+                     .join(NotebookCell, NotebookCell.sha == FileContentCell.cell_sha)
+                     .filter(FileContentCell.file_sha.in_(cell_shas))
+                     .order_by(FileContentCell.file_sha, FileContentCell.position))
+            if include_outputs:
+                query = query.outerjoin(CellOutputs, CellOutputs.sha == FileContentCell.outputs_sha)
+            for file_sha, cell_data, *outputs_data in query:
+                cells[file_sha].append((cell_data, outputs_data[0] if outputs_data else None))
+        for sha, content, notebook_data in batch:
+            yield sha, content if notebook_data is None else join_notebook_cells(notebook_data, cells[sha])
+
+
+def store_notebook_cells(strip_outputs=False, batch_size=FILE_BATCH_SIZE) -> int:
+    """Convert the notebooks that are stored as whole files to cell storage. Returns the number converted.
+
+    Each batch of files is converted in its own transaction.
+    """
+    query = (session.query(FileContent)
+             .options(undefer(FileContent.content))
+             .filter(FileContent.notebook_data.is_(None))
+             .filter(FileContent.content.isnot(None))
+             .filter((FileContent.content_type == PYNB_MIME_TYPE) | FileContent.content_type.is_(None)))
+    count = 0
+    last_id = 0
+    while True:
+        batch = query.filter(FileContent.id > last_id).order_by(FileContent.id).limit(batch_size).all()
+        if not batch:
+            break
+        new_cells, new_outputs = {}, {}
+        for file_content in batch:
+            parts = split_notebook_cells(file_content.content, strip_outputs=strip_outputs)
+            if parts is None:
+                continue
+            file_content.notebook_data, cells = parts
+            file_content.cells = make_cell_refs(file_content.sha, cells, new_cells, new_outputs)
+            file_content.content = None
+            file_content.content_type = PYNB_MIME_TYPE
+            count += 1
+        add_cells(new_cells, new_outputs)
+        last_id = batch[-1].id
+        session.commit()
+    return count
+
+
+def restore_notebook_files(batch_size=FILE_BATCH_SIZE) -> int:
+    """Convert the notebooks that are stored as cells back to whole files. Returns the number converted.
+
+    The cells are left in place, since other files can share them; `flask gc` deletes those that no file refers to.
+    """
+    query = (session.query(FileContent)
+             .options(undefer(FileContent.notebook_data))
+             .filter(FileContent.notebook_data.isnot(None)))
+    count = 0
+    while True:
+        batch = query.order_by(FileContent.id).limit(batch_size).all()
+        if not batch:
+            break
+        for file_content in batch:
+            file_content.content = file_content.read()
+            file_content.notebook_data = None
+            file_content.cells = []
+            count += 1
+        session.commit()
+    return count
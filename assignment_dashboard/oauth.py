@@ -1,10 +1,9 @@
-import github as pygithub
 from flask import g, redirect, request, session, url_for
 
 import flask_github
 
 from . import app
-from .models import User
+from .access import get_access_index, get_session_user
 
 # Globals
 #
@@ -24,7 +23,7 @@ def token_getter():
 def before_request():
     g.user = None
     if 'gh_login' in session:
-        g.user = User.query.filter(User.login == session['gh_login']).first()
+        g.user = get_session_user(session['gh_login'])
 
 
 # OAuth Routes
@@ -46,6 +45,7 @@ def logout():
 @app.route('/oauth/github/callback')
 @github.authorized_handler
 def authorized(access_token):
+    import github as pygithub
     next_url = request.args.get('next') or url_for('index')
     if access_token is None:
         return redirect(next_url)
@@ -54,4 +54,8 @@ def authorized(access_token):
     user = gh.get_user()
     session['access_token'] = access_token
     session['gh_login'] = user.login
+
+    user_instance = get_session_user(user.login, refresh=True)
+    if user_instance:
+        get_access_index(user_instance.id, refresh=True)
     return redirect(next_url)
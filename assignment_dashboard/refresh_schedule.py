@@ -0,0 +1,133 @@
+"""Choose the repos that the database updater refreshes, by how likely they are to have changed.
+
+Each repo is modeled as receiving pushes at a rate that combines:
+
+- its recent push rate, from the dates of its commits over the last ACTIVITY_WINDOW (not counting commits that are in
+  the source repo, which every fork shares);
+- a boost in the hours before and just after the due date of each of the source repo's assignments, when students
+  are most likely to push;
+- a small base rate, so that dormant repos are still refreshed occasionally.
+
+A repo's staleness is the expected total time that its unseen pushes have waited: rate × elapsed time² / 2 push-hours,
+where elapsed time is the time since its last refresh. A repo is due for a refresh once its staleness reaches
+REFRESH_STALENESS. This gives each repo a refresh interval of sqrt(2 × REFRESH_STALENESS / rate), clamped to
+[MIN_REFRESH_INTERVAL, MAX_REFRESH_INTERVAL]: active repos, and all repos near a due date, are refreshed often, and
+dormant repos rarely. (For a given number of refreshes, intervals proportional to 1 / sqrt(rate) minimize the average
+time before a push is seen.) The due repos are refreshed stalest first, until the GitHub API budget for the run is
+spent.
+
+scripts/simulate-refresh-schedule compares this with refreshing the least recently refreshed repos.
+"""
+
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, Mapping
+
+from sqlalchemy import func, or_
+
+from .assignment_metadata import due_date_to_utc
+from .database import session
+from .models import Assignment, Commit, Repo, repo_commits_table
+
+ACTIVITY_WINDOW = timedelta(days=14)
+BASE_PUSH_RATE = 1 / (14 * 24)  # pushes per hour
+
+# Around each due date, the push rate is raised by up to DEADLINE_PUSH_RATE. The boost increases linearly over
+# DEADLINE_LEAD_TIME, and continues for DEADLINE_LATE_TIME after the due date, for late submissions.
+DEADLINE_PUSH_RATE = 1.0  # pushes per hour
+DEADLINE_LEAD_TIME = timedelta(hours=48)
+DEADLINE_LATE_TIME = timedelta(hours=12)
+
+# Lower values refresh more often, at the cost of more API requests
+REFRESH_STALENESS = 0.25  # push-hours
+MIN_REFRESH_INTERVAL = timedelta(minutes=20)
+MAX_REFRESH_INTERVAL = timedelta(days=7)
+
+# Estimated GitHub API requests: one to list a repo's new commits, and a few for each new commit (its file list, its
+# tree, and its changed files)
+REQUESTS_PER_REFRESH = 1
+REQUESTS_PER_COMMIT = 3
+MAX_ESTIMATED_COMMITS = 10
+
+RefreshPlan = namedtuple('RefreshPlan', 'repo staleness interval cost')
+
+
+def get_recent_push_counts(source_repo: Repo, since: datetime) -> Mapping[int, int]:
+    """Return a dict of repo_id -> the number of commits since `since`, for source_repo and its forks.
+
+    A fork's count doesn't include the commits that it shares with source_repo.
+    """
+    source_commit_ids = (session.query(repo_commits_table.c.commit_id)
+                         .filter(repo_commits_table.c.repo_id == source_repo.id))
+    rows = (session.query(repo_commits_table.c.repo_id, func.count(Commit.id))
+            .join(Commit, Commit.id == repo_commits_table.c.commit_id)
+            .join(Repo, Repo.id == repo_commits_table.c.repo_id)
+            .filter(or_(Repo.id == source_repo.id, Repo.source_id == source_repo.id))
+            .filter(Commit.commit_date >= since)
+            .filter(or_(Repo.id == source_repo.id, ~repo_commits_table.c.commit_id.in_(source_commit_ids)))
+            .group_by(repo_commits_table.c.repo_id))
+    return dict(rows)
+
+
+def get_deadline_push_rate(due_dates: List[datetime], now: datetime) -> float:
+    """Return the push rate boost at time `now`, from the due dates."""
+    rate = 0
+    for due_date in due_dates:
+        time_before = due_date - now
+        if -DEADLINE_LATE_TIME <= time_before <= timedelta(0):
+            rate = max(rate, DEADLINE_PUSH_RATE)
+        elif timedelta(0) < time_before <= DEADLINE_LEAD_TIME:
+            rate = max(rate, DEADLINE_PUSH_RATE * (1 - time_before / DEADLINE_LEAD_TIME))
+    return rate
+
+
+def plan_refresh(repo: Repo, push_rate: float, now: datetime) -> RefreshPlan:
+    """Return the RefreshPlan for a repo whose predicted push rate (per hour) is push_rate."""
+    interval = timedelta(hours=math.sqrt(2 * REFRESH_STALENESS / push_rate))
+    interval = min(max(interval, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+    if repo.refreshed_at is None:
+        return RefreshPlan(repo, math.inf, interval, REQUESTS_PER_REFRESH + REQUESTS_PER_COMMIT * MAX_ESTIMATED_COMMITS)
+    elapsed_hours = max((now - repo.refreshed_at).total_seconds() / 3600, 0)
+    expected_commits = min(push_rate * elapsed_hours, MAX_ESTIMATED_COMMITS)
+    return RefreshPlan(repo,
+                       staleness=push_rate * elapsed_hours ** 2 / 2,
+                       interval=interval,
+                       cost=REQUESTS_PER_REFRESH + REQUESTS_PER_COMMIT * expected_commits)
+
+
+def plan_refreshes(source_repo: Repo, budget: float, now: datetime = None) -> List[RefreshPlan]:
+    """Return the plans for the active repos of source_repo's class that are due for a refresh.
+
+    The plans are ordered by staleness, and are limited to those whose summed estimated cost fits within budget API
+    requests. If the source repo is due, it comes first regardless of the budget, since it
+    defines the assignments.
+    """
+    now = now or datetime.utcnow()
+    push_counts = get_recent_push_counts(source_repo, now - ACTIVITY_WINDOW)
+    due_dates = [due_date_to_utc(due_date) for due_date, in (session.query(Assignment.due_date)
+                                                             .filter(Assignment.repo_id == source_repo.id)
+                                                             .filter(Assignment.due_date.isnot(None)))]
+    deadline_rate = get_deadline_push_rate(due_dates, now)
+    window_hours = ACTIVITY_WINDOW.total_seconds() / 3600
+
+    plans = [plan_refresh(repo, BASE_PUSH_RATE + deadline_rate + push_counts.get(repo.id, 0) / window_hours, now)
+             for repo in [source_repo] + [fork for fork in source_repo.forks if fork.is_active]]
+    return choose_refreshes(plans, budget, now, first=source_repo)
+
+
+def choose_refreshes(plans: List[RefreshPlan], budget: float, now: datetime, first=None) -> List[RefreshPlan]:
+    """Return the plans that are due, stalest first, whose summed cost fits within budget.
+
+    The plan for the repo `first`, if it's due, comes first regardless of the budget.
+    """
+    due_plans = sorted((plan for plan in plans
+                        if plan.repo.refreshed_at is None or now - plan.repo.refreshed_at >= plan.interval),
+                       key=lambda plan: (plan.repo is not first, -plan.staleness))
+    selected = []
+    for plan in due_plans:
+        if plan.repo is not first and plan.cost > budget:
+            continue
+        selected.append(plan)
+        budget -= plan.cost
+    return selected
@@ -0,0 +1,197 @@
+"""Delete the data that the dashboard no longer uses, under the retention policy in the app config.
+
+`flask gc` calls collect_garbage, which:
+
+- marks forks that haven't been refreshed in FORK_ARCHIVE_DAYS as inactive (GitHub no longer lists them, or their
+  source repo is no longer updated);
+- deletes commits that are older than COMMIT_RETENTION_DAYS;
+- deletes file revisions that are older than FILE_REVISION_RETENTION_DAYS, and that a later revision made before that
+  cutoff supersedes, so that a report as of any time since the cutoff is unchanged;
+- deletes the file contents that no FileCommit or FileRevision refers to, and the notebook cells and outputs that no
+  file refers to.
+
+Rows are deleted GC_BATCH_SIZE at a time, each batch in its own transaction, so that the database isn't locked for
+long. This is safe to run while the database updater runs: the updater marks the file contents and cells that it's
+about to refer to (see mark_seen) before it checks whether they exist, and unreferenced rows are only deleted if they
+haven't been marked within GC_GRACE_HOURS. Each delete re-checks its conditions.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Iterable, List
+
+from sqlalchemy import and_, exists, func, or_
+from sqlalchemy.orm import aliased
+
+from .app import app
+from .database import session
+from .models import (CellOutputs, Commit, FileCommit, FileContent, FileContentCell, FileRevision, NotebookCell, Repo,
+                     repo_commits_table)
+
+# The number of rows to delete in each transaction. SQLite limits a statement to 999 parameters.
+GC_BATCH_SIZE = 200
+
+GCResult = namedtuple('GCResult', 'description count size')
+
+
+def mark_seen(model, shas: Iterable[str]):
+    """Set the seen_at time of the instances of model (FileContent, NotebookCell or CellOutputs) with shas.
+
+    The caller is responsible for committing the session.
+    """
+    shas = list(shas)
+    now = datetime.utcnow()
+    for i in range(0, len(shas), GC_BATCH_SIZE):
+        (session.query(model)
+         .filter(model.sha.in_(shas[i:i + GC_BATCH_SIZE]))
+         .update({model.seen_at: now}, synchronize_session=False))
+
+
+def iter_id_batches(query, id_column, batch_size: int):
+    """Yield successive lists of rows of query, ordered by id_column, which must be the first column of each row."""
+    last_id = None
+    while True:
+        page = query if last_id is None else query.filter(id_column > last_id)
+        batch = page.order_by(id_column).limit(batch_size).all()
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield batch
+
+
+def archive_stale_forks(cutoff: datetime, dry_run=False) -> int:
+    """Mark forks that haven't been refreshed since cutoff as inactive. Returns the number of forks.
+
+    The database updater marks a fork as active again if GitHub lists it.
+    """
+    query = (session.query(Repo)
+             .filter(Repo.source_id.isnot(None))
+             .filter(Repo.is_active.is_(True))
+             .filter(Repo.refreshed_at < cutoff))
+    if dry_run:
+        return query.count()
+    count = query.update({Repo.is_active: False}, synchronize_session=False)
+    session.commit()
+    return count
+
+
+def delete_old_commits(cutoff: datetime, batch_size: int, dry_run=False) -> int:
+    """Delete the commits made before cutoff. Returns the number of commits."""
+    count = 0
+    for batch in iter_id_batches(session.query(Commit.id).filter(Commit.commit_date < cutoff), Commit.id, batch_size):
+        ids = [commit_id for commit_id, in batch]
+        count += len(ids)
+        if dry_run:
+            continue
+        session.execute(repo_commits_table.delete().where(repo_commits_table.c.commit_id.in_(ids)))
+        session.query(Commit).filter(Commit.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+    return count
+
+
+def delete_superseded_file_revisions(cutoff: datetime, batch_size: int, dry_run=False) -> int:
+    """Delete the file revisions before cutoff that a later revision before cutoff supersedes. Returns their number."""
+    later = aliased(FileRevision)
+    superseded = (exists()
+                  .where(later.repo_id == FileRevision.repo_id)
+                  .where(later.path == FileRevision.path)
+                  .where(later.mod_time > FileRevision.mod_time)
+                  .where(later.mod_time <= cutoff))
+    query = session.query(FileRevision.id).filter(FileRevision.mod_time < cutoff).filter(superseded)
+    count = 0
+    for batch in iter_id_batches(query, FileRevision.id, batch_size):
+        ids = [revision_id for revision_id, in batch]
+        count += len(ids)
+        if not dry_run:
+            session.query(FileRevision).filter(FileRevision.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+    return count
+
+
+def delete_unreferenced_file_contents(seen_before: datetime, batch_size: int, dry_run=False) -> GCResult:
+    """Delete the file contents that no FileCommit or FileRevision refers to, and that weren't seen since seen_before."""
+    collectable = and_(~exists().where(FileCommit.sha == FileContent.sha),
+                       ~exists().where(FileRevision.sha == FileContent.sha),
+                       or_(FileContent.seen_at.is_(None), FileContent.seen_at < seen_before))
+    size = (func.coalesce(func.length(FileContent.content), 0) +
+            func.coalesce(func.length(FileContent.notebook_data), 0))
+    count = total_size = 0
+    for batch in iter_id_batches(session.query(FileContent.id, FileContent.sha, size).filter(collectable),
+                                 FileContent.id, batch_size):
+        count += len(batch)
+        total_size += sum(row_size for _, _, row_size in batch)
+        if dry_run:
+            continue
+        shas = [sha for _, sha, _ in batch]
+        session.query(FileContent).filter(FileContent.sha.in_(shas)).filter(collectable).delete(synchronize_session=False)
+        (session.query(FileContentCell)
+         .filter(FileContentCell.file_sha.in_(shas))
+         .filter(~exists().where(FileContent.sha == FileContentCell.file_sha))
+         .delete(synchronize_session=False))
+        session.commit()
+    return GCResult('deleted unreferenced file contents', count, total_size)
+
+
+def delete_unreferenced_cells(seen_before: datetime, batch_size: int, dry_run=False) -> List[GCResult]:
+    """Delete the notebook cells and outputs that no file refers to, and that weren't seen since seen_before."""
+    results = []
+    for model, data_column, ref_column, description in [
+            (NotebookCell, NotebookCell.cell_data, FileContentCell.cell_sha, 'deleted unreferenced notebook cells'),
+            (CellOutputs, CellOutputs.outputs_data, FileContentCell.outputs_sha, 'deleted unreferenced cell outputs')]:
+        collectable = and_(~exists().where(ref_column == model.sha),
+                           or_(model.seen_at.is_(None), model.seen_at < seen_before))
+        count = total_size = 0
+        for batch in iter_id_batches(session.query(model.id, func.length(data_column)).filter(collectable),
+                                     model.id, batch_size):
+            count += len(batch)
+            total_size += sum(row_size for _, row_size in batch)
+            if not dry_run:
+                ids = [row_id for row_id, _ in batch]
+                session.query(model).filter(model.id.in_(ids)).filter(collectable).delete(synchronize_session=False)
+                session.commit()
+        results.append(GCResult(description, count, total_size))
+    return results
+
+
+def collect_garbage(batch_size=GC_BATCH_SIZE, dry_run=False) -> List[GCResult]:
+    """Apply the retention policy. Returns a GCResult for each kind of change; size is None for rows without content.
+
+    If dry_run is true, this only counts the rows that it would change.
+    """
+    config = app.config
+    now = datetime.utcnow()
+    results = []
+    if config['FORK_ARCHIVE_DAYS']:
+        count = archive_stale_forks(now - timedelta(days=config['FORK_ARCHIVE_DAYS']), dry_run=dry_run)
+        results.append(GCResult('archived stale forks', count, None))
+    if config['COMMIT_RETENTION_DAYS']:
+        count = delete_old_commits(now - timedelta(days=config['COMMIT_RETENTION_DAYS']), batch_size, dry_run=dry_run)
+        results.append(GCResult('deleted old commits', count, None))
+    if config['FILE_REVISION_RETENTION_DAYS']:
+        count = delete_superseded_file_revisions(now - timedelta(days=config['FILE_REVISION_RETENTION_DAYS']),
+                                                 batch_size, dry_run=dry_run)
+        results.append(GCResult('deleted superseded file revisions', count, None))
+    # these come last, since the deletions above can leave more file contents unreferenced
+    seen_before = now - timedelta(hours=config['GC_GRACE_HOURS'])
+    results.append(delete_unreferenced_file_contents(seen_before, batch_size, dry_run=dry_run))
+    results += delete_unreferenced_cells(seen_before, batch_size, dry_run=dry_run)
+    return results
+
+
+def get_sqlite_database_size() -> int:
+    """Return the size of a SQLite database, in bytes."""
+    connection = session.connection()
+    return connection.execute('PRAGMA page_count').scalar() * connection.execute('PRAGMA page_size').scalar()
+
+
+def vacuum_database() -> int:
+    """Return the space that was freed to the file system, in bytes, if the database is SQLite; else None.
+
+    This locks the database until it completes.
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        return None
+    session.commit()
+    size = get_sqlite_database_size()
+    session.connection().execute('VACUUM')
+    return size - get_sqlite_database_size()
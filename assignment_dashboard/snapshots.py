@@ -0,0 +1,70 @@
+"""Publish static snapshots of the dashboard, for nginx to serve without calling the web app.
+
+Snapshot files are named after the URL paths of the pages that they replace, e.g. `assignment_repo/1/index.html`
+for `/assignment_repo/1`. Each publication is written to a new versioned directory within SNAPSHOT_DIR, and the
+`current` symlink is then switched to it, so that nginx never serves a partially written snapshot. nginx checks access
+to the snapshot files via the web app's `/snapshot_auth` endpoint.
+"""
+
+import os
+import shutil
+from datetime import datetime
+
+from . import app
+from .database import session
+from .models import Assignment, Repo
+from .views import iter_assignment_repo_csv, render_assignment_answer_status, render_assignment_repo
+
+# The number of previous snapshot versions to keep, for requests that are still reading from them
+KEEP_VERSIONS = 2
+
+
+def write_snapshot_file(version_dir: str, url_path: str, content):
+    """Write content, a string or an iterable of strings, to the snapshot file for url_path."""
+    if isinstance(content, str):
+        content = [content]
+    path = os.path.join(version_dir, url_path.lstrip('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.writelines(content)
+
+
+def publish_snapshots(snapshot_dir=None) -> str:
+    """Render the assignment repo pages, CSV reports, and answer status pages into a new snapshot version.
+
+    Returns the path to the new version's directory.
+    """
+    snapshot_dir = snapshot_dir or app.config['SNAPSHOT_DIR']
+    version = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    version_dir = os.path.join(snapshot_dir, version)
+
+    repo_ids = [repo_id for repo_id, in session.query(Repo.id).filter(Repo.source_id.is_(None))]
+    assignment_ids = [assignment_id for assignment_id, in (session.query(Assignment.id)
+                                                           .filter(Assignment.repo_id.in_(repo_ids or [None])))]
+    with app.test_request_context():
+        for repo_id in repo_ids:
+            print("Publishing assignment repo %d" % repo_id)
+            write_snapshot_file(version_dir, '/assignment_repo/%d/index.html' % repo_id,
+                                render_assignment_repo(repo_id, snapshot=True))
+            write_snapshot_file(version_dir, '/assignment_repo/%d/report.csv' % repo_id,
+                                iter_assignment_repo_csv(repo_id))
+        for assignment_id in assignment_ids:
+            write_snapshot_file(version_dir, '/assignment/%d/answer_status.html' % assignment_id,
+                                render_assignment_answer_status(assignment_id))
+
+    # Switch the `current` symlink atomically, by renaming a new link over it
+    current_link = os.path.join(snapshot_dir, 'current')
+    tmp_link = current_link + '.tmp'
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(version, tmp_link)
+    os.replace(tmp_link, current_link)
+
+    previous_versions = sorted(name for name in os.listdir(snapshot_dir)
+                               if name != version
+                               and not os.path.islink(os.path.join(snapshot_dir, name))
+                               and os.path.isdir(os.path.join(snapshot_dir, name)))
+    for name in previous_versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(snapshot_dir, name))
+
+    return version_dir
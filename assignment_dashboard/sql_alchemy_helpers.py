@@ -1,5 +1,6 @@
 """Jupyter notebook helper functions."""
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 
@@ -21,6 +22,23 @@ def find_or_create(session, model, **kwargs):
         return q.one()
 
 
+def commit_with_retry(session, write):
+    """Call write(), which adds instances to the session, and commit the session. Returns the value of write().
+
+    If another process inserted a row with the same unique key in the meantime, the session is rolled back, and write()
+    is called and the session committed once more. write() should therefore skip or merge the rows that are already in
+    the database, as upsert_all does.
+    """
+    try:
+        result = write()
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        result = write()
+        session.commit()
+    return result
+
+
 def update_instance(instance, attrs):
     for k, v in attrs.items():
         setattr(instance, k, v)
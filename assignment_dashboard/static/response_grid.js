@@ -0,0 +1,171 @@
+// A virtualized student × assignment grid, for assignment repos with too many students to render as an HTML table.
+//
+// The grid reads the response matrix from the /api/v1 responses endpoint, and only creates elements for the rows and
+// columns that are scrolled into view.
+
+(function() {
+  'use strict';
+
+  var ROW_HEIGHT = 30;
+  var HEADER_HEIGHT = 60;
+  var NAME_WIDTH = 200;
+  var COLUMN_WIDTH = 140;
+  var OVERSCAN = 4;
+
+  var STATUS_TEXT = {
+    unchanged: 'unchanged from original',
+    unavailable: 'unable to retrieve file',
+    invalid_notebook: 'invalid notebook'
+  };
+  var STATUS_CSS_CLASSES = {unchanged: 'danger', unavailable: 'danger', invalid_notebook: 'warning'};
+
+  var DURATION_UNITS = [
+    ['year', 365 * 24 * 3600],
+    ['month', 30 * 24 * 3600],
+    ['week', 7 * 24 * 3600],
+    ['day', 24 * 3600],
+    ['hour', 3600],
+    ['minute', 60],
+    ['second', 1]
+  ];
+
+  // An approximation of babel.dates.format_timedelta, which the server-rendered table uses
+  function formatDuration(seconds) {
+    for (var i = 0; i < DURATION_UNITS.length; i++) {
+      var unit = DURATION_UNITS[i];
+      var value = Math.round(seconds / unit[1]);
+      if (value >= 1 || i === DURATION_UNITS.length - 1) {
+        return value + ' ' + unit[0] + (value === 1 ? '' : 's');
+      }
+    }
+  }
+
+  // The API's times are naive UTC
+  function parseTime(s) {
+    return s ? new Date(/[Z+]/.test(s) ? s : s + 'Z') : null;
+  }
+
+  function formatDate(date) {
+    return date.toLocaleString(undefined, {
+      weekday: 'short', month: 'short', day: 'numeric', hour: 'numeric', minute: '2-digit'
+    });
+  }
+
+  function escapeHtml(s) {
+    return $('<div>').text(s == null ? '' : s).html();
+  }
+
+  function ResponseGrid(element) {
+    this.$element = $(element);
+    this.$viewport = this.$element.find('.response-grid-viewport');
+    this.$canvas = this.$element.find('.response-grid-canvas');
+    this.assignmentUrl = this.$element.data('assignment-url');
+    this.responses = {};
+    this.frame = null;
+    this.$viewport.on('scroll', this.scheduleRender.bind(this));
+    $(window).on('resize', this.scheduleRender.bind(this));
+  }
+
+  ResponseGrid.prototype.load = function(data) {
+    var assignments = data.assignments;
+    var students = data.students;
+    this.assignments = assignments.id.map(function(id, i) {
+      return {
+        id: id,
+        path: assignments.path[i],
+        name: assignments.name[i] || assignments.path[i],
+        dueDate: parseTime(assignments.due_date[i])
+      };
+    });
+    this.students = students.id.map(function(id, i) {
+      return {
+        id: id,
+        name: students.name[i],
+        url: 'https://github.com/' + students.login[i] + '/' + students.repo_name[i]
+      };
+    }).sort(function(a, b) {
+      return a.name.toLowerCase().localeCompare(b.name.toLowerCase());
+    });
+    var responses = data.responses;
+    for (var i = 0; i < responses.assignment_id.length; i++) {
+      this.update(responses.assignment_id[i], responses.user_id[i], responses.status[i], responses.submitted_at[i]);
+    }
+    this.$canvas.css({
+      width: NAME_WIDTH + this.assignments.length * COLUMN_WIDTH,
+      height: HEADER_HEIGHT + this.students.length * ROW_HEIGHT
+    });
+    this.$element.removeClass('loading');
+    this.render();
+  };
+
+  ResponseGrid.prototype.update = function(assignmentId, userId, status, timestamp) {
+    this.responses[assignmentId + ':' + userId] = {status: status, submittedAt: parseTime(timestamp)};
+  };
+
+  ResponseGrid.prototype.scheduleRender = function() {
+    if (!this.frame && this.assignments) {
+      this.frame = window.requestAnimationFrame(function() {
+        this.frame = null;
+        this.render();
+      }.bind(this));
+    }
+  };
+
+  ResponseGrid.prototype.cellHtml = function(assignment, student) {
+    var response = this.responses[assignment.id + ':' + student.id] || {status: 'unavailable'};
+    var text = STATUS_TEXT[response.status];
+    if (!text && assignment.dueDate) {
+      var lateness = (response.submittedAt - assignment.dueDate) / 1000;
+      text = lateness <= 0 ? 'on time' : formatDuration(lateness) + ' late';
+    } else if (!text) {
+      text = formatDate(response.submittedAt);
+    }
+    return '<a href="' + escapeHtml(student.url + '/blob/master/' + assignment.path) + '" title="view on GitHub">' +
+      escapeHtml(text) + '</a>';
+  };
+
+  ResponseGrid.prototype.render = function() {
+    var viewport = this.$viewport[0];
+    var scrollTop = viewport.scrollTop;
+    var scrollLeft = viewport.scrollLeft;
+    var firstRow = Math.max(0, Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN);
+    var lastRow = Math.min(this.students.length,
+                           Math.ceil((scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+    var firstColumn = Math.max(0, Math.floor(scrollLeft / COLUMN_WIDTH) - OVERSCAN);
+    var lastColumn = Math.min(this.assignments.length,
+                              Math.ceil((scrollLeft + viewport.clientWidth) / COLUMN_WIDTH) + OVERSCAN);
+
+    function cell(className, left, top, width, height, html) {
+      return '<div class="response-grid-cell ' + className + '" style="left:' + left + 'px;top:' + top +
+        'px;width:' + width + 'px;height:' + height + 'px">' + html + '</div>';
+    }
+
+    var html = [];
+    for (var i = firstRow; i < lastRow; i++) {
+      var student = this.students[i];
+      var top = HEADER_HEIGHT + i * ROW_HEIGHT;
+      for (var j = firstColumn; j < lastColumn; j++) {
+        var assignment = this.assignments[j];
+        var response = this.responses[assignment.id + ':' + student.id];
+        var className = response ? STATUS_CSS_CLASSES[response.status] || '' : 'danger';
+        html.push(cell(className, NAME_WIDTH + j * COLUMN_WIDTH, top, COLUMN_WIDTH, ROW_HEIGHT,
+                       this.cellHtml(assignment, student)));
+      }
+      // the name column and the header row stay in view as the grid scrolls
+      html.push(cell('response-grid-name', scrollLeft, top, NAME_WIDTH, ROW_HEIGHT,
+                     '<a href="' + escapeHtml(student.url) + '" title="View the student repo on GitHub">' +
+                     escapeHtml(student.name) + '</a>'));
+    }
+    for (j = firstColumn; j < lastColumn; j++) {
+      assignment = this.assignments[j];
+      html.push(cell('response-grid-header', NAME_WIDTH + j * COLUMN_WIDTH, scrollTop, COLUMN_WIDTH, HEADER_HEIGHT,
+                     '<a href="' + escapeHtml(this.assignmentUrl.replace('{id}', assignment.id)) +
+                     '" title="View the combined notebook">' + escapeHtml(assignment.name) + '</a>' +
+                     (assignment.dueDate ? '<br><small>' + escapeHtml(formatDate(assignment.dueDate)) + '</small>' : '')));
+    }
+    html.push(cell('response-grid-header response-grid-name', scrollLeft, scrollTop, NAME_WIDTH, HEADER_HEIGHT, ''));
+    this.$canvas.html(html.join(''));
+  };
+
+  window.ResponseGrid = ResponseGrid;
+})();
@@ -1,23 +1,49 @@
 """Update the database from GitHub."""
 
 import base64
+import multiprocessing
 import os
+import traceback
 from collections import namedtuple
-from datetime import datetime, timedelta
-from typing import Iterable, List
+from datetime import datetime, timedelta, timezone
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Set
 
 import dateutil
-from github import Github
-
-from .database import session
-from .models import Commit, FileCommit, FileContent, Repo, User
-from .sql_alchemy_helpers import find_or_create, update_instance, upsert_all
+from github import Github, GithubException
+from sqlalchemy import func
+
+from .access import invalidate_access_indexes
+from .answer_search import index_response_files
+from .assignment_metadata import due_date_to_utc, update_assignment_metadata
+from .database import db, session
+from .leases import renew_lease, repo_lease
+from .live_updates import publish_response_updates
+from .models import Assignment, Commit, FileCommit, FileContent, FileRevision, Repo, User, repo_commits_table
+from .notebook_store import add_file_contents
+from .refresh_schedule import plan_refreshes
+from .retention import mark_seen
+from .sql_alchemy_helpers import commit_with_retry, find_or_create, update_instance, upsert_all
 
 # globals
 #
 
 REPROCESS_COMMITS = os.environ.get('REPROCESS_COMMITS', 'False') not in ('False', '0')
 
+# The number of downloaded files to write to the database in each transaction
+DOWNLOAD_BATCH_SIZE = 20
+
+# The number of commits to read, and to record, at a time
+COMMIT_BATCH_SIZE = 20
+
+# GitHub's compare API lists at most this many files
+COMPARE_FILE_LIMIT = 300
+
+# The number of GitHub API requests that a scheduled update (`updatedb --scheduled`) plans to spend on each source
+# repo, and the number that it leaves unspent
+REFRESH_API_BUDGET = int(os.environ.get('REFRESH_API_BUDGET', '1000'))
+GITHUB_API_RESERVE = int(os.environ.get('GITHUB_API_RESERVE', '500'))
+
 # TODO use user token associated with assignment repo
 GITHUB_API_TOKEN = os.environ['GITHUB_API_TOKEN']
 gh = Github(GITHUB_API_TOKEN)
@@ -26,7 +52,7 @@ gh = Github(GITHUB_API_TOKEN)
 # helpers
 #
 
-RepoCommitFile = namedtuple('RepoCommitItem', 'commit file')
+CommitFiles = namedtuple('CommitFiles', 'commit files')
 
 
 def unique_by(pairs: Iterable[tuple]) -> List:
@@ -35,6 +61,16 @@ def unique_by(pairs: Iterable[tuple]) -> List:
     return list({key: item for item, key in pairs}.values())
 
 
+def iter_batches(items: Iterable, size: int) -> Iterator[List]:
+    """Yield successive lists of up to size items from items."""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
 def get_file_content(repo, blob_url):
     blob = repo.get_git_blob(blob_url.split('/')[-1])
     content = blob.content
@@ -51,6 +87,18 @@ def parse_git_datetime(s: str) -> datetime:
     return dateutil.parser.parse(s)
 
 
+def get_commit_date(commit) -> datetime:
+    """Return a commit's date. Commits from a comparison don't have a Last-Modified header, so use the committer's."""
+    if commit.last_modified:
+        return parse_git_datetime(commit.last_modified)
+    return commit.commit.committer.date
+
+
+def to_naive_utc(dt: datetime) -> datetime:
+    """Return a datetime as a naive UTC datetime, which is how the database returns it."""
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+
 def own_commit(repo, commit):
     """Return true iff commit appears to be from the repo owner."""
     return not commit.author or commit.author == repo.owner or commit.author.login == 'web-flow'
@@ -66,11 +114,19 @@ def update_instructor_logins(source_repo):
     members = [u for u in gh.get_organization(org_name).get_members()]
     save_users(members, role='instructor')
 
-    for member in members:
-        member_instance = get_user_instance(member)
-        if org_instance not in member_instance.organizations:
-            member_instance.organizations.append(org_instance)
-    session.commit()
+    changed_user_ids = set()
+
+    def add_members():
+        changed_user_ids.clear()
+        for member in members:
+            member_instance = get_user_instance(member)
+            if org_instance not in member_instance.organizations:
+                member_instance.organizations.append(org_instance)
+                changed_user_ids.add(member_instance.id)
+
+    # updaters of other assignment repos in the same organization can add the same members
+    commit_with_retry(session, add_members)
+    invalidate_access_indexes(changed_user_ids)
 
 
 def get_forks(source_repo):
@@ -91,25 +147,28 @@ user_instance_map = {}
 
 def save_users(users: List, role='student'):
     print("Updating %ss in database" % role)
-    saved_instances = {instance.login: instance
-                       for instance in session.query(User).filter(User.login.in_(user.login for user in users))}
-    for user in users:
-        attrs = dict(
-            login=user.login,
-            avatar_url=user.avatar_url,
-            gh_type=user.type,
-            role=role,
-            **dict(fullname=user.name) if user.name else {},
-        )
-
-        instance = saved_instances.get(user.login)
-        if instance:
-            update_instance(instance, attrs)
-        else:
-            instance = User(**attrs)
-        session.add(instance)
 
-    session.commit()
+    def add_users():
+        saved_instances = {instance.login: instance
+                           for instance in session.query(User).filter(User.login.in_(user.login for user in users))}
+        for user in users:
+            attrs = dict(
+                login=user.login,
+                avatar_url=user.avatar_url,
+                gh_type=user.type,
+                role=role,
+                **dict(fullname=user.name) if user.name else {},
+            )
+
+            instance = saved_instances.get(user.login)
+            if instance:
+                update_instance(instance, attrs)
+            else:
+                instance = User(**attrs)
+            session.add(instance)
+
+    # a student can be in several classes, whose updaters can run in parallel
+    commit_with_retry(session, add_users)
 
     user_instances = list(session.query(User).filter(User.login.in_([user.login for user in users])))
     user_instance_map.update({instance.login: instance for instance in user_instances})  # FIXME there's surely some way to do this within the ORM
@@ -125,31 +184,23 @@ def get_user_instance(user):
 # update repos
 #
 
-repo_instance_map = None
-
-
-def get_repo_instance(repo):
-    global repo_instance_map
-    if not repo_instance_map:
-        repo_instance_map = {(instance.owner_id, instance.name): instance for instance in session.query(Repo)}
-    owner = get_user_instance(repo.owner)
-    return repo_instance_map[owner.id, repo.name]
-
-
 def save_repos(source_repo, repos):
     print("Updating %d repos in database" % len(repos))
     source_repo_instance = find_or_create(session, Repo, owner_id=get_user_instance(source_repo.owner).id, name=source_repo.name)
     session.commit()
     assert source_repo_instance.id
 
-    repo_instances = [Repo(owner_id=user_instance_map[repo.owner.login].id,
-                           name=repo.name,
-                           source_id=source_repo_instance.id,
-                           is_active=True)
-                      for repo in repos
-                      if repo != source_repo]
-    upsert_all(session, [source_repo_instance] + repo_instances, Repo.owner_id, Repo.name)
-    session.commit()
+    def add_repos():
+        repo_instances = [Repo(owner_id=user_instance_map[repo.owner.login].id,
+                               name=repo.name,
+                               source_id=source_repo_instance.id,
+                               is_active=True)
+                          for repo in repos
+                          if repo != source_repo]
+        upsert_all(session, [source_repo_instance] + repo_instances, Repo.owner_id, Repo.name)
+
+    # an overlapping update of the same assignment repo can add the same forks
+    commit_with_retry(session, add_repos)
 
 
 # record file commits
@@ -165,11 +216,12 @@ def get_repo_db_instance(gh_repo):
     return instance
 
 
-def get_new_repo_commits(repo, commit_limit=None, reprocess_commits=False):
-    repo_instance = get_repo_db_instance(repo)
+def get_new_repo_commits(repo, reprocess_commits=False):
+    """Return (head sha, an iterator over the new commits, newest first). The head sha is None if there are no commits.
 
-    saved_commits = set() if reprocess_commits else get_repo_instance(repo).commits
-    saved_commit_shas = {commit.sha for commit in saved_commits}
+    The commits are listed a page at a time, as the iterator is consumed.
+    """
+    repo_instance = get_repo_db_instance(repo)
 
     def get_commit_kwargs(repo):
         since = None
@@ -178,74 +230,118 @@ def get_new_repo_commits(repo, commit_limit=None, reprocess_commits=False):
         elif repo_instance.refreshed_at:
             since = repo_instance.refreshed_at + timedelta(days=-1)
         else:
-            date_tuple = (session.query(FileCommit.mod_time)
-                          .filter(FileCommit.repo_id == Repo.id)
-                          .filter(Repo.owner_id == User.id)
-                          .filter(User.login == repo.owner.login)
-                          .order_by(FileCommit.mod_time.desc())
-                          .first())
-            if date_tuple:
-                since = date_tuple[0] + timedelta(weeks=-1)
+            # uses the index on (repo_id, mod_time)
+            mod_time = (session.query(func.max(FileCommit.mod_time))
+                        .filter(FileCommit.repo_id == repo_instance.id)
+                        .scalar())
+            if mod_time:
+                since = mod_time + timedelta(weeks=-1)
 
         args = {}
         if since:
             args['since'] = since
         return args
 
-    repo_commits = [commit
-                    for commit in repo.get_commits(**get_commit_kwargs(repo))
-                    if commit.sha not in saved_commit_shas]
-
-    if commit_limit:
-        repo_commits = repo_commits[:commit_limit]
+    def omit_saved_commits(commits):
+        for batch in iter_batches(commits, COMMIT_BATCH_SIZE):
+            saved_commit_shas = get_saved_commit_shas(repo_instance.id, [commit.sha for commit in batch])
+            yield from (commit for commit in batch if commit.sha not in saved_commit_shas)
 
-    if repo_commits:
-        print("Processing %d new commits" % len(repo_commits))
+    listed_commits = iter(repo.get_commits(**get_commit_kwargs(repo)))
+    head_commit = next(listed_commits, None)
+    if not head_commit:
+        return None, iter([])
+    repo_commits = chain([head_commit], listed_commits)
+    if not reprocess_commits:
+        repo_commits = omit_saved_commits(repo_commits)
+    return head_commit.sha, repo_commits
 
-    return repo_commits
 
+def get_compared_changes(repo, all_commits=False):
+    """Return (head sha, a list of CommitFiles, newest first) from a single comparison with the repo's last-seen head.
 
-def get_file_commit_recs(repo, repo_commits, all_commits=False):
-    # file_commit_recs = unique_by(
-    #     (RepoCommitFile(commit, item), (repo.full_name, item.filename))
-    #     for commit in reversed(repo_commits)
-    #     if all_commits or own_commit(repo, commit)
-    #     for item in commit.files
-    #     if item.sha)
-    #
-    file_commit_recs = [
-        RepoCommitFile(commit, item)
-        for commit in reversed(repo_commits)
-        if all_commits or own_commit(repo, commit)
-        for item in commit.files
-        if item.sha]
+    This costs one API request, instead of one for each new commit. Each file that changed is recorded at its version
+    in the head commit, so intermediate versions aren't recorded.
 
-    if file_commit_recs:
-        print('Processing %d file commits' % len(file_commit_recs))
-
-    return file_commit_recs
-
-
-def download_files(repo, repo_commits, file_commit_recs):
-    incoming_file_shas = {item.file.sha for item in file_commit_recs}
+    Returns None if the changes can't be read this way, and must be read commit by commit instead: if the repo hasn't
+    been refreshed before, its history was rewritten, the comparison is truncated, the new commits span an assignment's
+    due date (so that as-of-due-date reports see the version at the due date), or, unless all_commits is true, some
+    new commits aren't the repo owner's.
+    """
+    repo_instance = get_repo_db_instance(repo)
+    if not repo_instance.head_sha:
+        return None
+    try:
+        comparison = repo.compare(repo_instance.head_sha, repo.default_branch)
+    except GithubException:
+        return None
+    if comparison.status == 'identical':
+        return repo_instance.head_sha, []
+
+    repo_commits = comparison.commits  # oldest first
+    if (comparison.status != 'ahead' or
+            comparison.total_commits > len(repo_commits) or
+            len(comparison.files) >= COMPARE_FILE_LIMIT or
+            not (all_commits or all(own_commit(repo, commit) for commit in repo_commits))):
+        return None
+    commit_dates = [to_naive_utc(get_commit_date(commit)) for commit in repo_commits]
+    due_dates = [due_date_to_utc(due_date) for due_date, in (session.query(Assignment.due_date)
+                                                             .filter(Assignment.repo_id == (repo_instance.source_id or
+                                                                                            repo_instance.id))
+                                                             .filter(Assignment.due_date.isnot(None)))]
+    if any(min(commit_dates) <= due_date < max(commit_dates) for due_date in due_dates):
+        return None
+
+    head_commit = repo_commits[-1]
+    files = [item for item in comparison.files if item.sha and item.status != 'removed']
+    print("Compared %d new commits: %d changed files" % (len(repo_commits), len(files)))
+    return head_commit.sha, ([CommitFiles(head_commit, files)] +
+                             [CommitFiles(commit, []) for commit in reversed(repo_commits[:-1])])
+
+
+def iter_commit_files(repo, repo_commits: Iterable, all_commits=False) -> Iterator[CommitFiles]:
+    """Yield a CommitFiles for each of repo_commits.
+
+    Unless all_commits is true, the files of commits that aren't the repo owner's are omitted. Reading a commit's files
+    costs an API request; this reads them as the iterator is consumed.
+    """
+    for commit in repo_commits:
+        files = [item for item in commit.files if item.sha] if all_commits or own_commit(repo, commit) else []
+        yield CommitFiles(commit, files)
+
+
+def download_files(repo, commit_files: List[CommitFiles]):
+    """Download and save the files of commit_files that aren't already in the database."""
+    incoming_file_shas = {item.sha for _, files in commit_files for item in files}
     if not incoming_file_shas:
         return
 
-    db_file_content_shas = {sha for sha, in session.query(FileContent.sha).filter(FileContent.sha.in_(incoming_file_shas))}
-
-    download_commits = ((commit, {item.file.filename
-                                  for item in file_commit_recs if item.commit == commit
-                                  if item.file.sha not in db_file_content_shas})
-                        for commit in repo_commits)
-
-    download_commits = ((commit, paths)
-                        for (commit, paths) in download_commits
-                        if paths)
-
+    # Mark the files before checking which exist, so that `flask gc` doesn't delete them before their FileCommits are
+    # recorded
+    mark_seen(FileContent, incoming_file_shas)
+    session.commit()
+    db_file_content_shas = set()
+    incoming_file_shas = list(incoming_file_shas)
+    for i in range(0, len(incoming_file_shas), COMMIT_SHA_QUERY_SIZE):
+        db_file_content_shas |= {sha for sha, in (session.query(FileContent.sha)
+                                                  .filter(FileContent.sha.in_(incoming_file_shas[i:i + COMMIT_SHA_QUERY_SIZE])))}
+
+    download_commits = [(commit, {item.filename for item in files if item.sha not in db_file_content_shas})
+                        for commit, files in commit_files]
+    download_commits = [(commit, paths) for commit, paths in download_commits if paths]
     if not download_commits:
         return
 
-    print("Downloading %d file(s)" % len(incoming_file_shas - db_file_content_shas))
+    print("Downloading %d file(s)" % len(set(incoming_file_shas) - db_file_content_shas))
+
+    # Accumulate downloads outside of a transaction, and write them in batches, so that the database updater holds
+    # the database's write lock briefly, and not while it waits for GitHub.
+    pending = []
+
+    def save_pending():
+        # updaters running in parallel can download the same files, and notebook cells
+        commit_with_retry(session, lambda: add_file_contents(pending))
+        del pending[:]
 
     seen = set()
     for commit, paths in download_commits:
@@ -259,47 +355,165 @@ def download_files(repo, repo_commits, file_commit_recs):
 
             print("Downloading %s/%s (sha=%s)" % (repo.full_name, item.path, item.sha))
             content = get_file_content(repo, item.url) if is_downloadable_path(item.path) else None
-            fc = FileContent(sha=item.sha, content=content)
-            session.add(fc)
-            session.commit()
-
-
-def update_file_commits(repo, file_commit_recs):
-    file_commits = [FileCommit(repo_id=get_repo_instance(repo).id,
-                               path=item.file.filename,
-                               mod_time=parse_git_datetime(item.commit.last_modified),
-                               sha=item.file.sha)
-                    for item in file_commit_recs]
-    upsert_all(session, file_commits, FileCommit.repo_id, FileCommit.path)
-    session.commit()
+            pending.append((item.sha, content))
+            if len(pending) >= DOWNLOAD_BATCH_SIZE:
+                save_pending()
+    save_pending()
+
+
+def get_saved_file_commit_times(repo_id: int, paths: List[str]) -> Dict[str, datetime]:
+    """Return a dict of path -> the mod_time of the recorded FileCommit, for the members of paths that have one."""
+    mod_times = {}
+    for i in range(0, len(paths), COMMIT_SHA_QUERY_SIZE):
+        mod_times.update(session.query(FileCommit.path, FileCommit.mod_time)
+                         .filter(FileCommit.repo_id == repo_id)
+                         .filter(FileCommit.path.in_(paths[i:i + COMMIT_SHA_QUERY_SIZE])))
+    return mod_times
+
+
+def update_file_commits(repo_instance: Repo, commit_files: List[CommitFiles]) -> List[FileCommit]:
+    """Record the files of commit_files, which are ordered newest first. Returns the FileCommits that were recorded.
+
+    Each file is recorded as a FileRevision. It's recorded as its path's FileCommit only if it's the newest version of
+    its path in commit_files, and is newer than the path's recorded FileCommit. An update processes commits newest
+    first, so the commits of later batches, and those of an update that resumes an interrupted one, are older than
+    those that have been recorded.
+    """
+    updated_at = datetime.utcnow()
+    file_commits = [FileCommit(repo_id=repo_instance.id,
+                               path=item.filename,
+                               mod_time=get_commit_date(commit),
+                               sha=item.sha,
+                               updated_at=updated_at)
+                    for commit, files in commit_files
+                    for item in files]
+    latest_file_commits = {}
+    for file_commit in file_commits:
+        latest_file_commits.setdefault(file_commit.path, file_commit)
+    saved_mod_times = get_saved_file_commit_times(repo_instance.id, list(latest_file_commits.keys()))
+    latest_file_commits = [file_commit
+                           for path, file_commit in latest_file_commits.items()
+                           if path not in saved_mod_times or
+                           to_naive_utc(saved_mod_times[path]) < to_naive_utc(file_commit.mod_time)]
+    upsert_all(session, latest_file_commits, FileCommit.repo_id, FileCommit.path)
+    append_file_revisions(file_commits)
+    return latest_file_commits
+
+
+def append_file_revisions(file_commits: List[FileCommit]):
+    """Add a FileRevision for each of file_commits that isn't already recorded.
+
+    file_commits can include several versions of a path, and versions that were recorded by a previous update.
+    """
+    if not file_commits:
+        return
+    revisions = unique_by((FileRevision(repo_id=fc.repo_id, path=fc.path, mod_time=to_naive_utc(fc.mod_time), sha=fc.sha),
+                           (fc.repo_id, fc.path, to_naive_utc(fc.mod_time), fc.sha))
+                          for fc in file_commits)
+    saved_keys = set()
+    for repo_id in {revision.repo_id for revision in revisions}:
+        min_mod_time = min(revision.mod_time for revision in revisions if revision.repo_id == repo_id)
+        saved_keys |= set(session.query(FileRevision.repo_id, FileRevision.path, FileRevision.mod_time, FileRevision.sha)
+                          .filter(FileRevision.repo_id == repo_id)
+                          .filter(FileRevision.mod_time >= min_mod_time))
+    session.add_all(revision for revision in revisions
+                    if (revision.repo_id, revision.path, revision.mod_time, revision.sha) not in saved_keys)
 
 
 # record repo commits
 #
 
-def record_repo_commits(repo, repo_commits, timestamp):
+COMMIT_SHA_QUERY_SIZE = 200  # the number of shas in each IN clause; SQLite limits the number of parameters
+
+
+def get_saved_commit_shas(repo_id: int, shas: List[str]) -> Set[str]:
+    """Return the members of shas that have been recorded as commits of repo_id."""
+    saved_shas = set()
+    for i in range(0, len(shas), COMMIT_SHA_QUERY_SIZE):
+        saved_shas |= {sha for sha, in (session.query(Commit.sha)
+                                        .join(repo_commits_table, repo_commits_table.c.commit_id == Commit.id)
+                                        .filter(repo_commits_table.c.repo_id == repo_id)
+                                        .filter(Commit.sha.in_(shas[i:i + COMMIT_SHA_QUERY_SIZE])))}
+    return saved_shas
+
+
+def add_repo_commits(repo_id: int, shas: List[str]):
+    """Record that the saved commits with shas are commits of repo_id."""
+    saved_shas = get_saved_commit_shas(repo_id, shas)
+    new_shas = [sha for sha in shas if sha not in saved_shas]
+    for i in range(0, len(new_shas), COMMIT_SHA_QUERY_SIZE):
+        commit_ids = [commit_id for commit_id, in (session.query(Commit.id)
+                                                   .filter(Commit.sha.in_(new_shas[i:i + COMMIT_SHA_QUERY_SIZE])))]
+        if commit_ids:
+            session.execute(repo_commits_table.insert(), [dict(repo_id=repo_id, commit_id=commit_id)
+                                                          for commit_id in commit_ids])
+
+
+def record_repo_commits(repo_instance: Repo, repo_commits: List):
+    """Record repo_commits as commits of repo_instance. The caller is responsible for committing the session."""
+    commit_instances = unique_by((Commit(sha=commit.sha, commit_date=get_commit_date(commit)), commit.sha)
+                                 for commit in repo_commits)
+    upsert_all(session, commit_instances, Commit.sha)
+    session.flush()
+    add_repo_commits(repo_instance.id, [commit.sha for commit in commit_instances])
+
+
+def update_repo_files(repo, all_commits=False, commit_limit=None, reprocess_commits=False, commit_history=False):
+    """Record the repo's new commits and files.
+
+    Unless commit_history, commit_limit, or reprocess_commits is set, the changed files are read from a comparison
+    with the last-seen head (see get_compared_changes), where possible.
+
+    Otherwise the commits are processed as a pipeline, COMMIT_BATCH_SIZE commits at a time, newest first: each batch
+    is listed, its commits' files are read, the new files are downloaded, and the batch is written to the database in
+    its own transaction and published, before the next batch is listed. Memory use is therefore independent of the
+    number of commits, and the first results are visible before a long update completes. If the update is interrupted,
+    the next one skips the batches that were recorded. If commit_limit leaves some new commits unread, the repo's
+    head_sha isn't advanced, so that the next comparison reads them.
+
+    The caller should hold the repo's lease (see leases.py). This renews it before each batch, and stops if another
+    updater has taken it over.
+    """
+    timestamp = datetime.utcnow()
     repo_instance = get_repo_db_instance(repo)
-    repo_instance.refreshed_at = timestamp
-    session.commit()
+    changes = None
+    if not (commit_history or commit_limit or reprocess_commits):
+        changes = get_compared_changes(repo, all_commits=all_commits)
+    if changes is not None:
+        head_sha, commit_files = changes
+    else:
+        head_sha, repo_commits = get_new_repo_commits(repo, reprocess_commits=reprocess_commits)
+        if commit_limit:
+            listed_commits = repo_commits
+            repo_commits = islice(listed_commits, commit_limit)
+        commit_files = iter_commit_files(repo, repo_commits, all_commits=all_commits)
+
+    def record_batch(batch):
+        file_commits = update_file_commits(repo_instance, batch)
+        record_repo_commits(repo_instance, [commit for commit, _ in batch])
+        return file_commits
+
+    for batch in iter_batches(commit_files, COMMIT_BATCH_SIZE):
+        if not renew_lease(repo_instance.id):
+            print("Stopping: the lease on %s expired, and another updater took it over" % repo.full_name)
+            return
+        print("Processing %d new commits" % len(batch))
+        download_files(repo, batch)
+        # updaters of other repos can record the same commits
+        file_commits = commit_with_retry(session, lambda: record_batch(batch))
+        index_response_files(repo_instance, file_commits)
+        publish_response_updates(repo_instance, file_commits)
+
+    if commit_limit and next(listed_commits, None) is not None:
+        # The limit skipped some new commits. Keep the previous head, so that the next comparison includes them.
+        head_sha = None
 
-    commit_instances = [Commit(repo_id=get_repo_instance(repo).id,
-                               sha=commit.sha,
-                               commit_date=parse_git_datetime(commit.last_modified))
-                        for commit in repo_commits]
-    upsert_all(session, commit_instances, Commit.repo_id, Commit.sha)
+    repo_instance.refreshed_at = timestamp
+    if head_sha:
+        repo_instance.head_sha = head_sha
     session.commit()
 
 
-def update_repo_files(repo, all_commits=False, commit_limit=None, reprocess_commits=False):
-    timestamp = datetime.utcnow()
-    repo_commits = get_new_repo_commits(repo, commit_limit=commit_limit, reprocess_commits=reprocess_commits)
-    file_commit_recs = get_file_commit_recs(repo, repo_commits, all_commits=all_commits)
-    if repo_commits:
-        download_files(repo, repo_commits, file_commit_recs)
-        update_file_commits(repo, file_commit_recs)
-    record_repo_commits(repo, repo_commits, timestamp)
-
-
 def add_repo(repo_name: str):
     owner_login, shortname = repo_name.split('/')
     owner = find_or_create(session, User, login=owner_login)
@@ -309,6 +523,20 @@ def add_repo(repo_name: str):
     update_db(repo_name)
 
 
+def get_scheduled_repos(gh_source_repo, gh_repos: List) -> List:
+    """Return the members of gh_repos that are due for a refresh, stalest first.
+
+    See refresh_schedule.py. Forks that aren't in the database yet are omitted; updating the users adds them.
+    """
+    budget = min(REFRESH_API_BUDGET, gh.rate_limiting[0] - GITHUB_API_RESERVE)
+    plans = plan_refreshes(get_repo_db_instance(gh_source_repo), budget)
+    gh_repo_map = {gh_repo.full_name: gh_repo for gh_repo in gh_repos}
+    plans = [plan for plan in plans if plan.repo.full_name in gh_repo_map]
+    print("%d of %d repos are due for a refresh (about %d API requests)" %
+          (len(plans), len(gh_repos), sum(plan.cost for plan in plans)))
+    return [gh_repo_map[plan.repo.full_name] for plan in plans]
+
+
 def update_db(source_repo_name: str, options={}):
     gh_source_repo = gh.get_repo(source_repo_name)
 
@@ -328,7 +556,9 @@ def update_db(source_repo_name: str, options={}):
     gh_repos = [gh_source_repo] + gh_forks
     if options.get('users'):
         gh_repos = [gh_repo for gh_repo in gh_repos if gh_repo.owner.login in options['users']]
-    if options.get('oldest_first'):
+    if options.get('scheduled'):
+        gh_repos = get_scheduled_repos(gh_source_repo, gh_repos)
+    elif options.get('oldest_first'):
         repo_instances = {r.full_name: r for r in get_repo_db_instance(gh_source_repo).forks}
         gh_repos = sorted(gh_repos,
                           key=lambda r: getattr(repo_instances.get(r.full_name), 'refreshed_at', None) or datetime(1972, 1, 1))
@@ -336,9 +566,57 @@ def update_db(source_repo_name: str, options={}):
         gh_repos = gh_repos[:options['repo_limit']]
 
     for i, gh_repo in enumerate(gh_repos):
-        print("Updating %s (%d/%d)" % (gh_repo.full_name, i + 1, len(gh_repos)))
-        update_repo_files(gh_repo,
-                          all_commits=(gh_repo == gh_source_repo),
-                          commit_limit=options.get('commit_limit'),
-                          reprocess_commits=options.get('reprocess_commits')
-                          )
+        if options.get('scheduled') and gh.rate_limiting[0] < GITHUB_API_RESERVE:
+            print("Stopping, with %d GitHub API requests remaining" % gh.rate_limiting[0])
+            break
+        with repo_lease(get_repo_db_instance(gh_repo).id) as leased:
+            if not leased:
+                print("Skipping %s, which another updater is refreshing (%d/%d)" % (gh_repo.full_name, i + 1, len(gh_repos)))
+                continue
+            print("Updating %s (%d/%d)" % (gh_repo.full_name, i + 1, len(gh_repos)))
+            update_repo_files(gh_repo,
+                              all_commits=(gh_repo == gh_source_repo),
+                              commit_limit=options.get('commit_limit'),
+                              reprocess_commits=options.get('reprocess_commits'),
+                              commit_history=options.get('commit_history'),
+                              )
+            if gh_repo == gh_source_repo:
+                update_assignment_metadata(get_repo_db_instance(gh_source_repo))
+
+
+def update_db_process(args):
+    """Call update_db in a worker process. Returns (source_repo_name, the traceback if it failed, else None)."""
+    source_repo_name, options = args
+    try:
+        update_db(source_repo_name, options)
+    except Exception:
+        return source_repo_name, traceback.format_exc()
+    return source_repo_name, None
+
+
+def update_source_repos(source_repo_names: List[str], options={}, processes=1) -> List[str]:
+    """Update each source repo and its forks. Returns the names of the source repos whose update failed.
+
+    If processes > 1, the source repos are updated in parallel, in a pool of that many worker processes; a failure is
+    reported, and doesn't stop the others. Otherwise they're updated in turn, and a failure raises an exception.
+    """
+    if processes <= 1 or len(source_repo_names) <= 1:
+        for source_repo_name in source_repo_names:
+            print("Updating %s" % source_repo_name)
+            update_db(source_repo_name, options)
+        return []
+
+    # the worker processes open their own database connections
+    session.remove()
+    db.engine.dispose()
+    failures = []
+    with multiprocessing.Pool(min(processes, len(source_repo_names))) as pool:
+        for source_repo_name, error in pool.imap_unordered(update_db_process,
+                                                           [(source_repo_name, options)
+                                                            for source_repo_name in source_repo_names]):
+            if error:
+                print("Failed to update %s:\n%s" % (source_repo_name, error))
+                failures.append(source_repo_name)
+            else:
+                print("Updated %s" % source_repo_name)
+    return failures
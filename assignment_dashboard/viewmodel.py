@@ -2,75 +2,104 @@
 Implements the View-Model of an MVVM architecture.
 """
 
+import copy
 import hashlib
 import pickle
-import re
 from collections import OrderedDict, namedtuple
-from itertools import takewhile
-from typing import List, Mapping
+from typing import List, Mapping, Tuple
 
-import dateutil.parser
-import nbformat
-from sqlalchemy.orm import joinedload, undefer
-
-from nbcollate import NotebookCollator
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload
 
 from . import app  # for cache
+from .access import get_access_index
+from .answer_search import index_assignment_answers
+from .assignment_metadata import (due_date_to_utc, read_question_names, update_assignment_file_list,
+                                  update_assignment_questions)
 from .database import session
 from .globals import NBFORMAT_VERSION, PYNB_MIME_TYPE
 from .helpers import lexituples
-from .models import Assignment, AssignmentQuestion, AssignmentQuestionResponse, FileCommit, Repo
-from .nb_helpers import safe_read_notebook
+from .models import Assignment, AssignmentAnswerStatus, FileCommit, FileContent, FileRevision, Repo, User
+from .nb_helpers import read_submission_notebook, read_submission_notebooks, safe_read_notebook, split_notebook_sections
+from .notebook_store import iter_file_contents
+from .sql_alchemy_helpers import update_instance
 
 AssignmentViewModel = namedtuple('AssignmentViewModel', 'assignment_path collated_nb answer_status')
 StudentViewModel = namedtuple('StudentViewModel', 'user repo display_name')
 AssignmentResponseViewModel = namedtuple('AssignmentResponseViewModel', 'assignment_repo assignments students responses')
 
+# The number of submission files to fetch from the database at a time, while collating an assignment.
+SUBMISSION_STREAM_BATCH_SIZE = 2
+
 
 def get_source_repos(user=None) -> List:
-    if not user:
-        return session.query(Repo).options(joinedload(Repo.owner)).filter(Repo.source_id.is_(None)).all()
-    # PERF replace this by a single query
-    return [r
-            for org in user.organizations
-            for r in org.repos
-            if r.is_source]
+    """Return the source repos; or, if user is specified, the source repos that the user has access to."""
+    repos = session.query(Repo).options(joinedload(Repo.owner)).filter(Repo.source_id.is_(None))
+    if user:
+        repos = repos.filter(Repo.id.in_(get_access_index(user.id).repo_ids or [None]))
+    return repos.all()
 
 
 def update_content_types(file_contents):
     for fc in file_contents:
         if fc.content_type is None:
-            content = fc.content
+            content = fc.read()
             if isinstance(content, bytes):
                 content = content.decode()
-            try:
-                nbformat.reads(content, as_version=NBFORMAT_VERSION)  # for effect
-                fc.content_type = PYNB_MIME_TYPE
-            except nbformat.reader.NotJSONError:
-                fc.content_type = ''
+            fc.content_type = PYNB_MIME_TYPE if safe_read_notebook(content) else ''
 
 
-def compute_assignment_name(path: str) -> str:
-    NOTEBOOK_ASSIGNMENT_PATH_RE = r'day(\d+)_reading_journal\.ipynb'
-    NOTEBOOK_ASSIGNMENT_PATH_TITLE_TEMPLATE = r'Journal #\1'
-    return re.sub(NOTEBOOK_ASSIGNMENT_PATH_RE, NOTEBOOK_ASSIGNMENT_PATH_TITLE_TEMPLATE, path)
+def query_assignment_file_commits(repo_id: int, paths: List[str], *entities):
+    """Return a query for the FileCommits with paths in an assignment repo or its forks.
 
+    `entities` are the columns to select; by default, FileCommit. The query filters on path and repo_id, so that it
+    can use the index on (path, repo_id).
+    """
+    repo_ids = session.query(Repo.id).filter(or_(Repo.id == repo_id, Repo.source_id == repo_id))
+    return (session.query(*(entities or [FileCommit]))
+            .select_from(FileCommit)
+            .filter(FileCommit.path.in_(paths or [None]))
+            .filter(FileCommit.repo_id.in_(repo_ids)))
 
-def update_assignment_file_list(assignment_repo, assignment_paths):
-    saved_assignments = {assignment.path: assignment
-                         for assignment in assignment_repo.assignments}
-    if set(assignment_paths) == set(saved_assignments):
-        return
 
-    map(session.delete, (assignment for assignment in assignment_repo.assignments if assignment.path not in assignment_paths))
-    assignment_repo.assignments = [(saved_assignments.get(path) or
-                                    Assignment(repo_id=assignment_repo.id, path=path, name=compute_assignment_name(path)))
-                                   for path in assignment_paths]
-    session.commit()
+def query_assignment_file_revisions(repo_id: int, path: str, as_of, *entities):
+    """Return a query for the latest FileRevision of path at or before as_of, in an assignment repo and each fork.
+
+    `entities` are the columns to select; by default, FileRevision. The query can also select Repo columns. For each
+    repo, the revision is found by a lookup on the index on (repo_id, path, mod_time), so the cost of the query depends
+    on the number of repos, not on the number of revisions.
+    """
+    latest_revision_id = (session.query(FileRevision.id)
+                          .filter(FileRevision.repo_id == Repo.id)
+                          .filter(FileRevision.path == path)
+                          .filter(FileRevision.mod_time <= as_of)
+                          .order_by(FileRevision.mod_time.desc(), FileRevision.id.desc())
+                          .limit(1)
+                          .correlate(Repo)
+                          .as_scalar())
+    return (session.query(*(entities or [FileRevision]))
+            .select_from(Repo)
+            .join(FileRevision, FileRevision.id == latest_revision_id)
+            .filter(or_(Repo.id == repo_id, Repo.source_id == repo_id)))
+
+
+def get_assignment_repo(repo_id: int) -> Repo:
+    """Return an assignment repo, after updating its assignments from its list of files."""
+    assignment_repo = (session.query(Repo)
+                       .options(joinedload(Repo.assignments))
+                       .options(joinedload(Repo.files))
+                       .filter(Repo.id == repo_id)
+                       .one())
+    update_assignment_file_list(assignment_repo, {f.path for f in assignment_repo.files if f.path.endswith('.ipynb')})
+    return assignment_repo
 
 
-def get_assignment_responses(repo_id: int) -> AssignmentResponseViewModel:
-    """Update the repo.assignments from its list of files."""
+def get_assignment_responses(repo_id: int, as_of_due_date=False) -> AssignmentResponseViewModel:
+    """Update the repo.assignments from its list of files.
+
+    If as_of_due_date is true, the response to each assignment that has a due date is the version of the file at the
+    due date, instead of the latest version.
+    """
     assignment_repo = (session.query(Repo)
                        .options(joinedload(Repo.assignments).
                                 joinedload(Assignment.repo))
@@ -82,45 +111,51 @@ def get_assignment_responses(repo_id: int) -> AssignmentResponseViewModel:
     update_assignment_file_list(assignment_repo, assignment_paths)
 
     # instead of assignment_repo.files, to avoid 1 + N
-    # TODO filter to forks of source
-    file_commits = (session.query(FileCommit)
+    file_commits = (query_assignment_file_commits(repo_id, assignment_paths)
                     .options(joinedload(FileCommit.repo))
-                    .filter(FileCommit.path.in_(assignment_paths))).all()
+                    .all())
     update_content_types([fc.file_content for fc in file_commits if fc.file_content])
     session.commit()
 
-    # TODO move CSS logic from here to template
-    def file_model(fc, path):
+    def file_model(fc, assignment):
         if not fc:
-            return dict(path=path, css_class='danger', unavailable=True)
-
-        d = dict(path=path, status='complete', submission_date=fc.mod_time)
-        if fc.sha in assignment_file_shas:
-            d.update(dict(css_class='danger', unchanged=True))
-        elif not fc.file_content:
-            d.update(dict(css_class='danger', unavailable=True))
-        elif fc.file_content.content_type != PYNB_MIME_TYPE:
-            d.update(dict(css_class='warning', invalid_notebook=True))
-        return d
+            return dict(path=assignment.path, css_class='danger', unavailable=True)
+        content_type = fc.file_content.content_type if fc.file_content else None
+        return get_response_model(assignment.path, get_response_status(fc.sha, content_type, assignment_file_shas),
+                                  fc.mod_time, due_date_to_utc(assignment.due_date))
 
     # re-query, since commit invalidates the cache
     # TODO DRY w/ code above
     assignment_repo = (session.query(Repo)
                        .options(joinedload(Repo.assignments).
                                 joinedload(Assignment.repo))
+                       .options(joinedload(Repo.assignments).
+                                joinedload(Assignment.file))
                        .options(joinedload(Repo.files))
                        .filter(Repo.id == repo_id)).first()
     assignment_paths = {fc.path for fc in assignment_repo.files}
-    file_commits = (session.query(FileCommit)
+    file_commits = (query_assignment_file_commits(repo_id, assignment_paths)
                     .options(joinedload(FileCommit.repo))
-                    .filter(FileCommit.path.in_(assignment_paths))).all()
+                    .all())
     assignment_file_shas = {fc.sha for fc in assignment_repo.files}
     user_path_files = {(fc.repo.owner_id, fc.path): fc
                        for fc in file_commits if fc.repo}
 
     assignments = assignment_repo.assignments
+    if as_of_due_date:
+        for assignment in assignments:
+            if not assignment.due_date:
+                continue
+            revisions = query_assignment_file_revisions(repo_id, assignment.path, due_date_to_utc(assignment.due_date),
+                                                        FileRevision, Repo.owner_id).all()
+            update_content_types([revision.file_content for revision, _ in revisions if revision.file_content])
+            for key in [key for key in user_path_files if key[1] == assignment.path]:
+                del user_path_files[key]
+            user_path_files.update({(owner_id, revision.path): revision for revision, owner_id in revisions})
+        session.commit()
+
     student_repos = session.query(Repo).filter(Repo.source_id.in_(a.repo_id for a in assignments)).options(joinedload(Repo.owner)).all()
-    responses = {assignment.id: {fork.owner_id: file_model(user_path_files.get((fork.owner_id, assignment.path)), assignment.path)
+    responses = {assignment.id: {fork.owner_id: file_model(user_path_files.get((fork.owner_id, assignment.path)), assignment)
                                  for fork in student_repos}
                  for assignment in assignments}
 
@@ -132,34 +167,219 @@ def get_assignment_responses(repo_id: int) -> AssignmentResponseViewModel:
         responses)
 
 
+def get_response_status(sha: str, content_type, assignment_file_shas) -> str:
+    """Return the status of a submitted file: 'complete', 'unchanged', 'unavailable', or 'invalid_notebook'.
+
+    `content_type` is None if the file content hasn't been downloaded.
+    """
+    if sha in assignment_file_shas:
+        return 'unchanged'
+    if content_type is None:
+        return 'unavailable'
+    if content_type != PYNB_MIME_TYPE:
+        return 'invalid_notebook'
+    return 'complete'
+
+
+# TODO move CSS logic from here to template
+RESPONSE_STATUS_CSS_CLASSES = {'unchanged': 'danger', 'unavailable': 'danger', 'invalid_notebook': 'warning'}
+
+
+def get_response_model(path: str, status: str, submission_date, due_date=None) -> dict:
+    """Return the dict that the assignment repo template uses to display a response with the specified status.
+
+    submission_date and due_date (the assignment's, from due_date_to_utc) are naive UTC datetimes.
+    """
+    d = dict(path=path, status='complete', submission_date=submission_date, due_date=due_date)
+    if status != 'complete':
+        d.update({'css_class': RESPONSE_STATUS_CSS_CLASSES[status], status: True})
+    return d
+
+
+def get_response_matrix_version(repo_id: int) -> str:
+    """Return a string that changes whenever the response matrix of the forks of repo_id changes.
+
+    This uses aggregate queries, and is much cheaper than get_response_matrix.
+    """
+    file_stats = (session.query(func.count(FileCommit.id), func.max(FileCommit.updated_at))
+                  .join(Repo, Repo.id == FileCommit.repo_id)
+                  .filter(Repo.source_id == repo_id)
+                  .one())
+    fork_count = session.query(func.count(Repo.id)).filter(Repo.source_id == repo_id).scalar()
+    assignments = (session.query(Assignment.id, Assignment.name, Assignment.due_date, Assignment.md5,
+                                 Assignment.metadata_sha)
+                   .filter(Assignment.repo_id == repo_id)
+                   .order_by(Assignment.id)
+                   .all())
+    return hashlib.md5(repr((file_stats, fork_count, assignments)).encode()).hexdigest()
+
+
+def get_response_matrix(repo_id: int, since=None) -> Mapping:
+    """Return the responses to a repo's assignments, in a columnar layout.
+
+    The result has these entries, each a dict of column name -> list of values:
+
+    * assignments: id, path, name, due_date
+    * students: id, login, name, repo_name
+    * responses: assignment_id, user_id, status, submitted_at. This lists only the files that are present in a
+      student repo. If since is specified, it lists only files that the updater recorded a new version of after since.
+      (submitted_at is the time of the file's commit, which can be much earlier.)
+    * questions: assignment_id, names, status_names, user_ids, statuses. This lists the per-question answer statuses
+      of the assignments that have been collated. statuses[i] is a questions × students matrix of indices into
+      status_names[i].
+    * last_modified: the time that the updater recorded the latest of the listed files, or None if none are listed.
+
+    All times, including the assignments' due dates, are naive UTC datetimes.
+    """
+    assignment_repo = (session.query(Repo)
+                       .options(joinedload(Repo.assignments).joinedload(Assignment.answer_status))
+                       .options(joinedload(Repo.assignments).joinedload(Assignment.questions))
+                       .filter(Repo.id == repo_id)
+                       .one())
+    assignments = sorted(assignment_repo.assignments, key=lambda a: lexituples(a.name or a.path))
+    assignment_ids = {assignment.path: assignment.id for assignment in assignments}
+    assignment_file_shas = {sha for sha, in session.query(FileCommit.sha).filter(FileCommit.repo_id == repo_id)}
+
+    students = (session.query(User.id, User.login, User.fullname, Repo.name)
+                .join(Repo, Repo.owner_id == User.id)
+                .filter(Repo.source_id == repo_id)
+                .order_by(User.login)
+                .all())
+
+    fork_files = (session.query(FileCommit.sha)
+                  .join(Repo, Repo.id == FileCommit.repo_id)
+                  .filter(Repo.source_id == repo_id)
+                  .filter(FileCommit.path.in_(assignment_ids or [None])))
+    if since:
+        fork_files = fork_files.filter(FileCommit.updated_at > since)
+    update_content_types(session.query(FileContent)
+                         .filter(FileContent.sha.in_(fork_files))
+                         .filter(FileContent.content_type.is_(None)))
+    session.commit()
+
+    rows = (session.query(FileCommit.path, Repo.owner_id, FileCommit.sha, FileCommit.mod_time, FileContent.content_type,
+                          FileCommit.updated_at)
+            .join(Repo, Repo.id == FileCommit.repo_id)
+            .outerjoin(FileContent, FileContent.sha == FileCommit.sha)
+            .filter(Repo.source_id == repo_id)
+            .filter(FileCommit.path.in_(assignment_ids or [None])))
+    if since:
+        rows = rows.filter(FileCommit.updated_at > since)
+    rows = rows.order_by(FileCommit.mod_time).all()
+    updated_ats = [updated_at for *_, updated_at in rows if updated_at]
+
+    answer_statuses = [(assignment, assignment.answer_status) for assignment in assignments if assignment.answer_status]
+    return dict(
+        assignments=dict(
+            id=[a.id for a in assignments],
+            path=[a.path for a in assignments],
+            name=[a.name for a in assignments],
+            due_date=[due_date_to_utc(a.due_date) for a in assignments]),
+        students=dict(
+            id=[user_id for user_id, _, _, _ in students],
+            login=[login for _, login, _, _ in students],
+            name=[fullname or login for _, login, fullname, _ in students],
+            repo_name=[repo_name for _, _, _, repo_name in students]),
+        responses=dict(
+            assignment_id=[assignment_ids[path] for path, *_ in rows],
+            user_id=[user_id for _, user_id, *_ in rows],
+            status=[get_response_status(sha, content_type, assignment_file_shas)
+                    for _, _, sha, _, content_type, _ in rows],
+            submitted_at=[mod_time for _, _, _, mod_time, *_ in rows]),
+        questions=dict(
+            assignment_id=[a.id for a, _ in answer_statuses],
+            names=[[q.question_name for q in sorted(a.questions, key=lambda q: q.position)] for a, _ in answer_statuses],
+            status_names=[answer_status.status_names for _, answer_status in answer_statuses],
+            user_ids=[answer_status.user_ids.tolist() for _, answer_status in answer_statuses],
+            statuses=[answer_status.matrix.tolist() for _, answer_status in answer_statuses]),
+        last_modified=max(updated_ats) if updated_ats else None,
+    )
+
+
 def find_assignment(assignment_id: int) -> Assignment:
     """Return an Assignment.
 
-    The associated repo and repo owner are eagerly loaded.
+    The associated repo and repo owner, and the assignment file, are eagerly loaded.
     """
-    return session.query(Assignment).options(joinedload(Assignment.repo)).filter(Assignment.id == assignment_id).one()
+    return (session.query(Assignment)
+            .options(joinedload(Assignment.repo))
+            .options(joinedload(Assignment.file))
+            .filter(Assignment.id == assignment_id)
+            .one())
+
+
+def get_assignment_question_names(assignment: Assignment) -> List[str]:
+    """Return an assignment's question names, in order, without collating its responses.
+
+    These are its stored AssignmentQuestions, which updatedb reads from the assignment notebook. If updatedb hasn't
+    read the current version of the notebook yet, they're read from the notebook.
+    """
+    if assignment.file and assignment.metadata_sha != assignment.file.sha:
+        return read_question_names(assignment.notebook)
+    return [question.question_name for question in sorted(assignment.questions, key=lambda q: q.position)]
 
 
 def get_assignment_response_checksum(assignment: Assignment) -> str:
     """Return a constant that detects whether the set or contents of response files changes."""
-    # FIXME restrict to forks of the assignment repo
-    files = session.query(FileCommit).filter(FileCommit.path == assignment.path)
-    return hashlib.md5(pickle.dumps(sorted(fc.sha for fc in files))).hexdigest()
+    shas = query_assignment_file_commits(assignment.repo_id, [assignment.path], FileCommit.sha)
+    return hashlib.md5(pickle.dumps(sorted(sha for sha, in shas))).hexdigest()
 
 
-def _compute_assignment_responses(assignment: Assignment, checksum=None) -> Mapping:
-    """Update an assignment's related AssignmentQuestions, AssignmentQuestionResponses; return collated notebooks."""
-    file_commits = [fc
-                    for fc in (session.query(FileCommit)
-                               .options(joinedload(FileCommit.repo).joinedload(Repo.owner))
-                               .options(joinedload(FileCommit.file_content))
-                               .options(undefer('file_content.content'))
-                               .filter(FileCommit.path == assignment.path))
-                    if fc.repo]
-
-    notebooks = {fc.repo.owner.login: safe_read_notebook(fc.content.decode())
-                 for fc in file_commits
-                 if fc.file_content}
+def read_assignment_notebooks(assignment: Assignment, as_of=None) -> Mapping:
+    """Return a dict of login -> (user_id, notebook), for each repo that contains the assignment's file.
+
+    If as_of is specified, the notebooks are the revisions of the file at that time.
+
+    File contents are streamed from the database and parsed one at a time (or one batch at a time, if
+    COLLATION_PROCESSES is set), and each distinct file is parsed only once. The raw content is released as soon as
+    it's parsed, so that only a few raw files are in memory at a time. The parsed notebooks are all returned, since
+    the collator takes them together, so memory still grows with the size of the class; they don't include outputs,
+    which keeps them small.
+    """
+    if as_of:
+        login_shas = (query_assignment_file_revisions(assignment.repo_id, assignment.path, as_of,
+                                                      User.login, User.id, FileRevision.sha)
+                      .join(User, User.id == Repo.owner_id)
+                      .all())
+        file_shas = query_assignment_file_revisions(assignment.repo_id, assignment.path, as_of, FileRevision.sha)
+    else:
+        login_shas = (query_assignment_file_commits(assignment.repo_id, [assignment.path],
+                                                    User.login, User.id, FileCommit.sha)
+                      .join(Repo, Repo.id == FileCommit.repo_id)
+                      .join(User, User.id == Repo.owner_id)
+                      .all())
+        file_shas = query_assignment_file_commits(assignment.repo_id, [assignment.path], FileCommit.sha)
+    contents = iter_file_contents(file_shas, include_outputs=False, batch_size=SUBMISSION_STREAM_BATCH_SIZE)
+    sha_notebooks = dict(read_submission_notebooks(contents, processes=app.config['COLLATION_PROCESSES']))
+
+    # Several repos can hold the same file (e.g. an unchanged copy of the assignment). The collator annotates the
+    # cells of the notebooks that it's passed, so each of these gets its own copy.
+    seen_shas = set()
+    notebooks = {}
+    for login, user_id, sha in login_shas:
+        if sha not in sha_notebooks:
+            continue
+        nb = sha_notebooks[sha]
+        if nb and sha in seen_shas:
+            nb = copy.deepcopy(nb)
+        seen_shas.add(sha)
+        notebooks[login] = (user_id, nb)
+    return notebooks
+
+
+def collate_assignment_notebooks(assignment: Assignment, as_of=None):
+    """Return a NotebookCollator for an assignment, and the dict of login -> (user_id, notebook) that it collates.
+
+    If as_of is specified, the notebooks are the revisions at that time.
+    """
+    from nbcollate import NotebookCollator
+
+    user_notebooks = read_assignment_notebooks(assignment, as_of=as_of)
+    if as_of and assignment.repo.owner.login not in user_notebooks:
+        # the history of the assignment file might not go back to as_of; use its current version
+        user_notebooks[assignment.repo.owner.login] = (assignment.repo.owner_id,
+                                                       read_submission_notebook(assignment.content))
+    notebooks = {login: nb for login, (_, nb) in user_notebooks.items()}
 
     student_nbs = OrderedDict(sorted(
         ((login, nb)
@@ -170,43 +390,55 @@ def _compute_assignment_responses(assignment: Assignment, checksum=None) -> Mapp
         "%s: %s is not in %s" % (assignment.path, assignment.repo.owner.login, notebooks.keys())
     assignment_nb = notebooks[assignment.repo.owner.login]
 
-    collator = NotebookCollator(assignment_nb, student_nbs)
+    return NotebookCollator(assignment_nb, student_nbs), user_notebooks
 
-    answer_status = collator.report_missing_answers()
-    student_login_id_map = {fc.repo.owner.login: fc.repo.owner.id for fc in file_commits}
-    questions = [AssignmentQuestion(assignment_id=assignment.id,
-                                    position=position,
-                                    question_name=question_name,
-                                    responses=[AssignmentQuestionResponse(user_id=student_login_id_map[login],
-                                                                          status=status)
-                                               for login, status in d.items()])
-                 for position, (question_name, d) in enumerate(answer_status)]
-
-    assignment.questions = []
-    session.commit()
 
-    assignment.questions = questions
+def _compute_assignment_responses(assignment: Assignment, checksum=None) -> Mapping:
+    """Update an assignment's related AssignmentQuestions and AssignmentAnswerStatus; return collated notebooks."""
+    import nbformat
+
+    collator, user_notebooks = collate_assignment_notebooks(assignment)
+    answer_status = collator.report_missing_answers()
+    student_login_id_map = {login: user_id for login, (user_id, _) in user_notebooks.items()}
+    student_ids = sorted({student_login_id_map[login] for _, d in answer_status for login in d})
+    question_names = [question_name for question_name, _ in answer_status]
+    update_assignment_questions(assignment, question_names)
+    index_assignment_answers(assignment, question_names, user_notebooks)
+    answer_status_attrs = AssignmentAnswerStatus.pack_statuses(
+        student_ids,
+        [{student_login_id_map[login]: status for login, status in d.items()} for _, d in answer_status])
+    if assignment.answer_status:
+        update_instance(assignment.answer_status, answer_status_attrs)
+    else:
+        assignment.answer_status = AssignmentAnswerStatus(**answer_status_attrs)
     assignment.md5 = checksum
     session.add(assignment)
     session.commit()
 
-    return {'usernames/%s' % include_usernames:
-            nbformat.writes(collator.get_collated_notebook(
-                clear_outputs=True, include_usernames=include_usernames))
-            for include_usernames in [False, True]}
+    # Each collation is also split into per-question notebooks, for the paged collation view
+    results = {}
+    for include_usernames in [False, True]:
+        key = 'usernames/%s' % include_usernames
+        nb = collator.get_collated_notebook(clear_outputs=True, include_usernames=include_usernames)
+        results[key] = nbformat.writes(nb)
+        for position, section in enumerate(split_notebook_sections(nb, question_names)):
+            results['%s/questions/%d' % (key, position)] = nbformat.writes(section)
+    return results
 
 
 def update_assignment_responses(assignment_id: int, selector='assignment'):
-    """Update an assignment's related AssignmentQuestions and AssignmentQuestionResponses, and create the collations.
+    """Update an assignment's related AssignmentQuestions and AssignmentAnswerStatus, and create the collations.
 
     Return the assignment instance if selector == 'assignment' (the default).
-    Return a collated notebook if selector is a dict.
+    Return a collated notebook if selector is a dict. If the dict has a 'question' entry, this is the section of the
+    collated notebook for the question at that position. If the dict's 'source' entry is true, the notebook is returned
+    as its serialized JSON string, without parsing it.
 
     This method uses the app cache.
     """
     assignment = (session.query(Assignment)
-                  .options(joinedload(Assignment.questions).
-                           joinedload(AssignmentQuestion.responses))
+                  .options(joinedload(Assignment.questions))
+                  .options(joinedload(Assignment.answer_status))
                   .options(joinedload(Assignment.repo).joinedload(Repo.owner))
                   .filter(Assignment.id == assignment_id)
                   .one())
@@ -216,55 +448,102 @@ def update_assignment_responses(assignment_id: int, selector='assignment'):
     key_prefix = 'responses/%s/' % assignment_id
     checksum_key = key_prefix + 'checksum'
     selector_subkey = selector if selector == 'assignment' else 'usernames/%s' % selector['include_usernames']
+    if selector != 'assignment' and 'question' in selector:
+        selector_subkey += '/questions/%d' % selector['question']
 
-    if assignment.md5 == checksum and app.cache.get(checksum_key) == checksum:
-        return (assignment if selector == 'assignment'
-                else nbformat.reads(app.cache.get(key_prefix + selector_subkey), as_version=NBFORMAT_VERSION))
+    def select(result):
+        import nbformat
+        if selector == 'assignment':
+            return assignment
+        if result is None or selector.get('source'):
+            return result
+        return nbformat.reads(result, as_version=NBFORMAT_VERSION)
+
+    if assignment.md5 == checksum and assignment.answer_status and app.cache.get(checksum_key) == checksum:
+        return select(app.cache.get(key_prefix + selector_subkey) if selector != 'assignment' else None)
 
     results = _compute_assignment_responses(assignment, checksum=checksum)
     for k, v in results.items():
         app.cache.set(key_prefix + k, v)
     app.cache.set(checksum_key, checksum)  # do this last to insure integrity
 
-    return (assignment if selector == 'assignment'
-            else nbformat.reads(results[selector_subkey], as_version=NBFORMAT_VERSION))
+    return select(results.get(selector_subkey))
 
 
-def get_assignment_due_date(assignment: Assignment):
-    """Return an assignment's due date.
+def get_collated_notebook(assignment_id: int, include_usernames=False, as_of_due_date=False):
+    """Return the collated notebook for an assignment, updating it if necessary, and using the cache.
 
-    If this is not present in the database, try to read it from the first few markdown cells.
+    If as_of_due_date is true and the assignment has a due date, the notebook collates the submissions as of the due
+    date.
     """
-    if assignment.due_date:
-        return assignment.due_date
-
-    nb = assignment.notebook
-    if not nb or not nb.cells:
-        return
-
-    m = next((re.search('Due:?\s*(.+)', nb.cells[0].source, re.I)
-              for cell in takewhile(lambda c: c.cell_type == 'markdown', nb.cells[:5])),
-             None)
-    if not m:
-        return
-
-    # prepare the date for dateutil.parse, which doesn't know "noon"
-    s = m.group(1)
-    s = re.sub(r'(12(:00)?)? ?noon', '12:00PM', s)
-    s = re.sub(r'~~.*?~~', '', s)
-    s = re.sub(r'\*', '', s)
-    # TODO parse relative to timezone
-    try:
-        d = dateutil.parser.parse(s, fuzzy=True, default=assignment.file.mod_time)
-        print(d)
-    except ValueError:
-        return
-    else:
-        assignment.due_date = d
-        session.commit()
-        return d
+    if as_of_due_date:
+        assignment = find_assignment(assignment_id)
+        if assignment.due_date:
+            return get_collated_notebook_as_of(assignment, due_date_to_utc(assignment.due_date),
+                                               include_usernames=include_usernames)
+    return update_assignment_responses(assignment_id, selector={'include_usernames': include_usernames})
 
 
-def get_collated_notebook(assignment_id: int, include_usernames=False):
-    """Return the collated notebook for an assignment, updating it if necessary, and using the cache."""
-    return update_assignment_responses(assignment_id, selector={'include_usernames': include_usernames})
+def get_collated_notebook_as_of(assignment: Assignment, as_of, include_usernames=False):
+    """Return the collated notebook of an assignment's submissions at the time as_of.
+
+    The result is cached, keyed by the submitted files. Unlike update_assignment_responses, this doesn't update the
+    assignment's questions or answer status.
+    """
+    import nbformat
+    shas = query_assignment_file_revisions(assignment.repo_id, assignment.path, as_of, FileRevision.sha)
+    checksum = hashlib.md5(pickle.dumps(sorted(sha for sha, in shas))).hexdigest()
+    cache_key = 'responses/%d/as_of/%s/usernames/%s' % (assignment.id, checksum, include_usernames)
+    source = app.cache.get(cache_key)
+    if source is None:
+        collator, _ = collate_assignment_notebooks(assignment, as_of=as_of)
+        source = nbformat.writes(collator.get_collated_notebook(clear_outputs=True, include_usernames=include_usernames))
+        app.cache.set(cache_key, source)
+    return nbformat.reads(source, as_version=NBFORMAT_VERSION)
+
+
+def get_answer_status_columns(assignment: Assignment) -> Tuple[List[str], Mapping[int, List[str]]]:
+    """Return an assignment's question names, and a dict of user_id -> [status for each question].
+
+    This decodes the assignment's AssignmentAnswerStatus; it doesn't update it.
+    """
+    questions = [question.question_name for question in sorted(assignment.questions, key=lambda q: q.position)]
+    answer_status = assignment.answer_status
+    if not answer_status:
+        return questions, {}
+    status_names = answer_status.status_names
+    return questions, {user_id: [status_names[code] for code in codes]
+                       for user_id, codes in zip(answer_status.user_ids.tolist(), answer_status.matrix.T.tolist())}
+
+
+def get_answer_status_table(assignment: Assignment) -> Tuple[List[str], List[Tuple[str, List[str]]]]:
+    """Return an assignment's question names, and a list of (student display name, [status for each question]).
+
+    The rows are sorted by display name. This decodes the assignment's AssignmentAnswerStatus; it doesn't
+    update it.
+    """
+    questions, user_statuses = get_answer_status_columns(assignment)
+    names = {user_id: fullname or login
+             for user_id, login, fullname in (session.query(User.id, User.login, User.fullname)
+                                              .filter(User.id.in_(user_statuses or [None])))}
+    rows = [(names.get(user_id, str(user_id)), statuses) for user_id, statuses in user_statuses.items()]
+    return questions, sorted(rows, key=lambda row: row[0].lower())
+
+
+def get_collated_question_source(assignment_id: int, position: int, include_usernames=False) -> str:
+    """Return the section of an assignment's collated notebook for one question, as a JSON string, or None if there is
+    no such question.
+
+    This uses the cache, and updates the collation if necessary.
+    """
+    return update_assignment_responses(assignment_id, selector={'include_usernames': include_usernames,
+                                                                'question': position, 'source': True})
+
+
+def get_collated_notebook_source(assignment_id: int, include_usernames=False) -> str:
+    """Return the collated notebook for an assignment as a JSON string, updating it if necessary, and using the cache.
+
+    This avoids parsing and re-serializing the notebook, for callers that only need its file content.
+    """
+    return update_assignment_responses(assignment_id,
+                                       selector={'include_usernames': include_usernames, 'source': True})
@@ -1,21 +1,29 @@
+import hashlib
+import json
 import os
+import re
 from datetime import date, datetime
+from typing import Iterator
 
-import nbformat
-import pandas as pd
+import dateutil.parser
 import pytz
-from babel.dates import format_timedelta
-from flask import flash, g, make_response, redirect, render_template, request, url_for
-from nbconvert import HTMLExporter
+from flask import (Response, abort, flash, g, get_template_attribute, make_response, redirect, render_template, request,
+                   stream_with_context, url_for)
+from sqlalchemy.orm import joinedload
 
 from . import app
+from .answer_search import get_answer_snippet, search_answers
+from .assignment_metadata import due_date_to_utc
 from .database import session
-from .decorators import login_required, requires_access
+from .decorators import login_required, requires_access, user_has_access
 from .globals import NBFORMAT_VERSION, PYNB_MIME_TYPE
+from .helpers import gzip_chunks, iter_chunks, iter_csv_lines
+from .live_updates import subscribe_response_updates
 from .model_helpers import InvalidInput, update_names_from_csv
 from .models import Assignment, Repo
-from .viewmodel import (find_assignment, get_assignment_due_date, get_assignment_responses, get_collated_notebook,
-                        get_source_repos, update_assignment_responses)
+from .viewmodel import (find_assignment, get_answer_status_columns, get_answer_status_table, get_assignment_question_names,
+                        get_assignment_repo, get_assignment_responses, get_collated_notebook, get_collated_notebook_source,
+                        get_collated_question_source, get_response_model, get_source_repos, update_assignment_responses)
 
 
 # Filters
@@ -23,6 +31,7 @@ from .viewmodel import (find_assignment, get_assignment_due_date, get_assignment
 
 @app.template_filter()
 def timesince(dt, t0=None):
+    from babel.dates import format_timedelta
     t0 = t0 or datetime.now(pytz.utc)
     return format_timedelta(dt - t0)
 
@@ -32,6 +41,21 @@ def datetimeformat(dt, fmt):
     return dt.strftime(fmt)
 
 
+# Helpers
+#
+
+def requested_as_of_due_date() -> bool:
+    """Return true if the request asks for submissions as of each assignment's due date, with `?as_of=due_date`."""
+    return request.args.get('as_of') == 'due_date'
+
+
+def notebook_html(nb, **kwargs) -> str:
+    """Render a notebook as HTML. kwargs are passed to the HTMLExporter."""
+    from nbconvert import HTMLExporter  # nbconvert is slow to import; only load it if a notebook is rendered
+    html, _ = HTMLExporter(**kwargs).from_notebook_node(nb)
+    return html
+
+
 # Routes
 #
 
@@ -52,6 +76,21 @@ def health_check():
     return 'success'
 
 
+@app.route('/snapshot_auth')
+def snapshot_auth():
+    """Authorize a request for a published snapshot, for nginx's auth_request.
+
+    Responds 204 if the user can view the page at the X-Original-URI request header, else 401.
+    """
+    if not app.config['REQUIRE_LOGIN']:
+        return '', 204
+    m = re.match(r'/(assignment_repo|assignment)/(\d+)(/|$)', request.headers.get('X-Original-URI', ''))
+    if not m or g.user is None:
+        return '', 401
+    model_name = 'repo' if m.group(1) == 'assignment_repo' else 'assignment'
+    return ('', 204) if user_has_access(g.user, model_name, int(m.group(2))) else ('', 401)
+
+
 @app.errorhandler(401)
 def unauthorized_error(error):
     return render_template('401.html'), 401
@@ -86,47 +125,177 @@ def upload_names():
 @app.route('/assignment_repo/<int:repo_id>')
 @requires_access('repo')
 def assignment_repo(repo_id: int):
-    model = get_assignment_responses(repo_id)
-    assignment_repo = model.assignment_repo
+    response = make_response(render_assignment_repo(repo_id))
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def render_assignment_repo(repo_id: int, **kwargs) -> str:
+    """Render the assignment repo page. kwargs are passed to the template.
+
+    If the repo has more than VIRTUAL_GRID_THRESHOLD students, or the `grid` query parameter is 'virtual', this renders
+    a page shell that doesn't depend on the responses, and that the browser fills in from the API. The `grid` query
+    parameter 'table' forces a server-rendered table, as does `?as_of=due_date`, which displays the submissions as of
+    each assignment's due date.
+    """
+    grid = request.args.get('grid')
+    as_of_due_date = requested_as_of_due_date()
+    student_count = session.query(Repo).filter(Repo.source_id == repo_id).count()
+    virtual_grid = not as_of_due_date and (
+        grid == 'virtual' or (grid != 'table' and student_count > app.config['VIRTUAL_GRID_THRESHOLD']))
+    if virtual_grid:
+        assignment_repo = get_assignment_repo(repo_id)
+        kwargs.update(assignments=assignment_repo.assignments)
+    else:
+        model = get_assignment_responses(repo_id, as_of_due_date=as_of_due_date)
+        assignment_repo = model.assignment_repo
+        kwargs.update(assignments=model.assignments, students=model.students, responses=model.responses)
 
     repo_update_time, = (session.query(Repo.refreshed_at)
                          .filter(Repo.source_id == assignment_repo.id)
                          .order_by(Repo.refreshed_at.asc())
-                         .first())
+                         .first()) or (None,)
     if repo_update_time:
         repo_update_time = repo_update_time.replace(tzinfo=pytz.utc)
 
-    for assgn in model.assignments:
-        get_assignment_due_date(assgn)
-
     return render_template(
         'assignment_repo.html',
         classroom_owner=assignment_repo.owner,
         assignment_repo=assignment_repo,
         repo_update_time=repo_update_time,
-        assignments=model.assignments,
-        students=model.students,
-        responses=model.responses)
+        virtual_grid=virtual_grid,
+        as_of_due_date=as_of_due_date,
+        **kwargs)
+
+
+@app.route('/assignment_repo/<int:repo_id>/events')
+@requires_access('repo')
+def assignment_repo_events(repo_id: int):
+    """Stream a server-sent event with the rendered table cell of each response that is updated for repo_id.
+
+    Responds with 204 No Content, which tells the browser not to reconnect, if Redis isn't configured.
+    """
+    messages = subscribe_response_updates(repo_id)
+    if messages is None:
+        return '', 204
+
+    assignments = {a.id: a for a in session.query(Assignment).filter(Assignment.repo_id == repo_id)}
+    student_repos = {repo.owner_id: repo
+                     for repo in (session.query(Repo)
+                                  .options(joinedload(Repo.owner))
+                                  .filter(Repo.source_id == repo_id))}
+    response_cell = get_template_attribute('_response_cell.html', 'response_cell')
+    # The stream can stay open for hours. Release the database connection and its read transaction now, rather than
+    # when the response ends; the events only use the objects that were loaded above.
+    session.close()
+
+    def events():
+        for message in messages:
+            if not message:
+                yield ': keepalive\n\n'  # a comment, so that a closed connection is detected
+                continue
+            assignment = assignments.get(message['assignment'])
+            repo = student_repos.get(message['student'])
+            if not assignment or not repo:
+                continue
+            submission_date = dateutil.parser.parse(message['timestamp'])
+            if submission_date.tzinfo:
+                submission_date = submission_date.astimezone(pytz.utc).replace(tzinfo=None)
+            response = get_response_model(assignment.path, message['status'], submission_date,
+                                          due_date_to_utc(assignment.due_date))
+            data = dict(message, html=str(response_cell(repo, assignment, response)))
+            yield 'event: response\ndata: %s\n\n' % json.dumps(data)
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # tell nginx not to buffer the stream
+    return response
 
 
 @app.route('/assignment_repo/<int:repo_id>/report.csv')
 @requires_access('repo')
 def assignment_repo_csv(repo_id: int):
-    model = get_assignment_responses(repo_id)
-    df = pd.DataFrame({(assgn.name or assgn.path):
-                       {student.display_name:
-                        model.responses[assgn.id][student.user.id].get('status')
-                        for student in model.students}
-                       for assgn in model.assignments},
-                      columns=[a.name or a.path for a in model.assignments])
-    response = make_response(df.to_csv())
+    """Return a CSV file with each student's status on each assignment.
+
+    The `timestamps` query parameter adds a column with the submission time of each assignment. The `questions` query
+    parameter adds a column with the answer status of each question of each collated assignment. `?as_of=due_date`
+    reports the submissions as of each assignment's due date.
+    """
+    lines = iter_assignment_repo_csv(repo_id,
+                                     include_timestamps=bool(request.args.get('timestamps')),
+                                     include_questions=bool(request.args.get('questions')),
+                                     as_of_due_date=requested_as_of_due_date())
+    response = Response(stream_with_context(lines), mimetype='text/csv')
     now = date.today()
     filename = '%s Reading Journal Status.csv' % now.strftime('%Y-%m-%d')
     response.headers['Content-Disposition'] = "attachment; filename*=utf-8''%s" % filename
-    response.headers['Content-Type'] = 'text/csv'
     return response
 
 
+def iter_assignment_repo_csv(repo_id: int, include_timestamps=False, include_questions=False,
+                             as_of_due_date=False) -> Iterator[str]:
+    """Return an iterator over the lines of the assignment repo CSV report.
+
+    The model is computed before this returns; the lines are generated as they're consumed. The question statuses are
+    those of the latest collation, even if as_of_due_date is true.
+    """
+    model = get_assignment_responses(repo_id, as_of_due_date=as_of_due_date)
+    assignments = model.assignments
+    students = sorted(model.students, key=lambda student: student.display_name.lower())
+
+    question_columns = []  # (assignment name, question name, {user_id: status})
+    if include_questions:
+        for assgn in assignments:
+            questions, user_statuses = get_answer_status_columns(assgn)
+            for position, question_name in enumerate(questions):
+                question_columns.append((assgn.name or assgn.path, question_name,
+                                         {user_id: statuses[position] for user_id, statuses in user_statuses.items()}))
+
+    def rows():
+        header = ['']
+        for assgn in assignments:
+            header.append(assgn.name or assgn.path)
+            if include_timestamps:
+                header.append('%s submitted' % (assgn.name or assgn.path))
+        header += ['%s: %s' % (assignment_name, question_name) for assignment_name, question_name, _ in question_columns]
+        yield header
+
+        for student in students:
+            row = [student.display_name]
+            for assgn in assignments:
+                response = model.responses[assgn.id][student.user.id]
+                row.append(response.get('status'))
+                if include_timestamps:
+                    submission_date = response.get('submission_date')
+                    row.append(submission_date.isoformat() if submission_date else None)
+            row += [statuses.get(student.user.id) for _, _, statuses in question_columns]
+            yield row
+
+    return iter_csv_lines(rows())
+
+
+@app.route('/assignment_repo/<int:repo_id>/search')
+@requires_access('repo')
+def assignment_repo_search(repo_id: int):
+    """Search the students' answers to the assignments of repo_id, for the `q` query parameter."""
+    assignment_repo = session.query(Repo).options(joinedload(Repo.owner)).filter(Repo.id == repo_id).first()
+    if not assignment_repo:
+        abort(404)
+    query = request.args.get('q', '').strip()
+    results = [dict(assignment=assignment,
+                    student=user,
+                    question_name=question_name,
+                    snippet=get_answer_snippet(answer_cell.source, query))
+               for answer_cell, assignment, user, question_name in search_answers(repo_id, query)]
+    return render_template(
+        'search.html',
+        classroom_owner=assignment_repo.owner,
+        assignment_repo=assignment_repo,
+        query=query,
+        results=results)
+
+
 # HTML from HTMLExporter.from_notebook_node requests this
 @app.route('/assignment/custom.css')
 def empty():
@@ -137,58 +306,103 @@ def empty():
 @requires_access('assignment')
 def assignment(assignment_id: int):
     assignment = find_assignment(assignment_id)
-    return render_template('assignment.html', assignment=assignment, classroom_owner=assignment.repo.owner)
+    # The paged collation lists the questions. These come from the assignment notebook, so that the page doesn't wait
+    # for a collation; the question fragments collate the responses.
+    question_names = get_assignment_question_names(assignment) if app.config['PAGED_COLLATION'] else []
+    return render_template('assignment.html', assignment=assignment, question_names=question_names,
+                           classroom_owner=assignment.repo.owner)
 
 
 @app.route('/assignment/<int:assignment_id>.ipynb.html')
 @requires_access('assignment')
 def assignment_notebook(assignment_id: int):
+    import nbformat
     assignment = find_assignment(assignment_id)
     content = assignment.content
     if isinstance(content, bytes):
         content = content.decode()
-    nb = nbformat.reads(content, NBFORMAT_VERSION)
-    return HTMLExporter().from_notebook_node(nb)
+    return notebook_html(nbformat.reads(content, NBFORMAT_VERSION))
 
 
 @app.route('/assignment/<int:assignment_id>/collated.ipynb.html')
 @requires_access('assignment')
 def collated_assignment(assignment_id: int):
-    nb = get_collated_notebook(assignment_id, include_usernames=False)
-    return HTMLExporter().from_notebook_node(nb)
+    return notebook_html(get_collated_notebook(assignment_id, include_usernames=False,
+                                               as_of_due_date=requested_as_of_due_date()))
 
 
 @app.route('/assignment/<int:assignment_id>/named.ipynb.html')
 @requires_access('assignment')
 def collated_assignment_with_names(assignment_id: int):
-    nb = get_collated_notebook(assignment_id, include_usernames=True)
-    return HTMLExporter().from_notebook_node(nb)
+    return notebook_html(get_collated_notebook(assignment_id, include_usernames=True,
+                                               as_of_due_date=requested_as_of_due_date()))
+
+
+@app.route('/assignment/<int:assignment_id>/questions/<int:position>/collated.html', defaults={'include_usernames': False})
+@app.route('/assignment/<int:assignment_id>/questions/<int:position>/named.html', defaults={'include_usernames': True})
+@requires_access('assignment')
+def collated_assignment_question(assignment_id: int, position: int, include_usernames: bool):
+    """Return an HTML fragment with one question's section of the collated notebook."""
+    import nbformat
+    source = get_collated_question_source(assignment_id, position, include_usernames=include_usernames)
+    if source is None:
+        abort(404)
+    # keyed by the section's content, which changes whenever the collation does
+    cache_key = 'responses/%d/html/%s' % (assignment_id, hashlib.md5(source.encode()).hexdigest())
+    html = app.cache.get(cache_key)
+    if html is None:
+        html = notebook_html(nbformat.reads(source, NBFORMAT_VERSION), template_file='basic')
+        app.cache.set(cache_key, html)
+    return html
 
 
 @app.route('/assignment/<int:assignment_id>/collated.ipynb')
 @requires_access('assignment')
 def download_collated_assignment(assignment_id: int):
+    import nbformat
     assignment = Assignment.query.get(assignment_id)
     filename = '%s-collation%s' % os.path.splitext(os.path.basename(assignment.path))
-    nb = get_collated_notebook(assignment_id, include_usernames=False)
-
-    response = make_response(nbformat.writes(nb))
+    if requested_as_of_due_date():
+        source = nbformat.writes(get_collated_notebook(assignment_id, as_of_due_date=True))
+    else:
+        source = get_collated_notebook_source(assignment_id, include_usernames=False)
+
+    # Stream the cached notebook file, rather than parsing and re-serializing it into another copy
+    chunks = iter_chunks(source)
+    gzip = request.accept_encodings['gzip'] > 0
+    if gzip:
+        chunks = gzip_chunks(chunks)
+    response = Response(chunks, mimetype=PYNB_MIME_TYPE)
     response.headers['Content-Disposition'] = "attachment; filename*=utf-8''%s" % filename
-    response.headers['Content-Type'] = PYNB_MIME_TYPE
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
     return response
 
 
 @app.route('/assignment/<int:assignment_id>/answer_status.html')
 @requires_access('assignment')
 def assignment_answer_status(assignment_id: int):
+    return render_assignment_answer_status(assignment_id)
+
+
+def render_assignment_answer_status(assignment_id: int) -> str:
     assignment = update_assignment_responses(assignment_id)
-    status_map = [(question.question_name, {(response.user.fullname or response.user.login): response.status
-                                            for response in question.responses})
-                  for question in sorted(assignment.questions, key=lambda q: q.position)]
-    students = status_map[0][1].keys() if status_map else []
+    questions, rows = get_answer_status_table(assignment)
     return render_template(
         '_answer_status.html',
-        questions=[a for a, _ in status_map],
-        students=students,
-        status_map=status_map
+        questions=questions,
+        rows=rows
     )
+
+
+@app.route('/assignment/<int:assignment_id>/answer_status.csv')
+@requires_access('assignment')
+def assignment_answer_status_csv(assignment_id: int):
+    assignment = update_assignment_responses(assignment_id)
+    questions, rows = get_answer_status_table(assignment)
+    lines = iter_csv_lines([['Student'] + questions] + [[name] + statuses for name, statuses in rows])
+    response = Response(lines, mimetype='text/csv')
+    filename = '%s Answer Status.csv' % os.path.splitext(os.path.basename(assignment.path))[0]
+    response.headers['Content-Disposition'] = "attachment; filename*=utf-8''%s" % filename
+    return response
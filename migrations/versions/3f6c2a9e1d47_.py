@@ -0,0 +1,91 @@
+"""replace assignment_question_response by assignment_answer_status
+
+Revision ID: 3f6c2a9e1d47
+Revises: 8b737786dee3
+Create Date: 2026-10-19 09:12:40.318265
+
+"""
+import struct
+from collections import defaultdict
+from itertools import groupby
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2a9e1d47'
+down_revision = '8b737786dee3'
+branch_labels = None
+depends_on = None
+
+assignment_question_table = sa.table('assignment_question',
+                                     sa.column('id', sa.Integer),
+                                     sa.column('assignment_id', sa.Integer),
+                                     sa.column('position', sa.Integer))
+assignment_question_response_table = sa.table('assignment_question_response',
+                                              sa.column('assignment_question_id', sa.Integer),
+                                              sa.column('user_id', sa.Integer),
+                                              sa.column('status', sa.String))
+
+
+def pack_answer_statuses(connection):
+    """Return an assignment_answer_status row for each assignment that has assignment_question_response rows.
+
+    This packs the rows as AssignmentAnswerStatus does, without importing the models, which may have changed.
+    """
+    statuses = defaultdict(dict)  # question id -> user id -> status
+    for question_id, user_id, status in connection.execute(
+            sa.select([assignment_question_response_table.c.assignment_question_id,
+                       assignment_question_response_table.c.user_id,
+                       assignment_question_response_table.c.status])):
+        if status:
+            statuses[question_id][user_id] = status
+
+    questions = connection.execute(
+        sa.select([assignment_question_table.c.assignment_id, assignment_question_table.c.id])
+        .order_by(assignment_question_table.c.assignment_id, assignment_question_table.c.position))
+    rows = []
+    for assignment_id, group in groupby(questions, key=lambda row: row[0]):
+        question_statuses = [statuses[question_id] for _, question_id in group]
+        user_ids = sorted({user_id for d in question_statuses for user_id in d})
+        if not user_ids:
+            continue
+        status_names = [''] + sorted({status for d in question_statuses for status in d.values()})
+        codes = {name: i for i, name in enumerate(status_names)}
+        rows.append(dict(assignment_id=assignment_id,
+                         user_ids=struct.pack('<%di' % len(user_ids), *user_ids),
+                         status_names='\n'.join(status_names),
+                         statuses=bytes(codes[d.get(user_id, '')] for d in question_statuses for user_id in user_ids)))
+    return rows
+
+
+def upgrade():
+    answer_status_table = op.create_table('assignment_answer_status',
+                                          sa.Column('id', sa.Integer(), nullable=False),
+                                          sa.Column('assignment_id', sa.Integer(), nullable=False),
+                                          sa.Column('user_ids', sa.LargeBinary(), nullable=False),
+                                          sa.Column('status_names', sa.Text(), nullable=False),
+                                          sa.Column('statuses', sa.LargeBinary(), nullable=False),
+                                          sa.ForeignKeyConstraint(['assignment_id'], ['assignment.id'], ),
+                                          sa.PrimaryKeyConstraint('id'),
+                                          sa.UniqueConstraint('assignment_id')
+                                          )
+    # copy the statuses of the collated assignments; those that weren't collated are computed when they are
+    op.bulk_insert(answer_status_table, pack_answer_statuses(op.get_bind()))
+    op.drop_table('assignment_question_response')
+
+
+def downgrade():
+    op.create_table('assignment_question_response',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('assignment_question_id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('status', sa.String(length=20), nullable=True),
+                    sa.Column('notebook_data', sa.Text(), nullable=True),
+                    sa.ForeignKeyConstraint(['assignment_question_id'], ['assignment_question.id'], ),
+                    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('assignment_question_id', 'user_id')
+                    )
+    op.drop_table('assignment_answer_status')
+    op.execute("UPDATE assignment SET md5 = NULL")
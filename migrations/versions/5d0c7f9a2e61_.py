@@ -0,0 +1,46 @@
+"""add file_revision
+
+Revision ID: 5d0c7f9a2e61
+Revises: f3b8d2c6a914
+Create Date: 2026-10-19 15:47:09.331208
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5d0c7f9a2e61'
+down_revision = 'f3b8d2c6a914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    file_revision = op.create_table('file_revision',
+                                    sa.Column('id', sa.Integer(), nullable=False),
+                                    sa.Column('repo_id', sa.Integer(), nullable=False),
+                                    sa.Column('path', sa.String(length=1024), nullable=False),
+                                    sa.Column('mod_time', sa.DateTime(), nullable=False),
+                                    sa.Column('sha', sa.String(length=40), nullable=False),
+                                    sa.CheckConstraint('length(sha) = 40'),
+                                    sa.ForeignKeyConstraint(['repo_id'], ['repo.id'], ),
+                                    sa.ForeignKeyConstraint(['sha'], ['file_content.sha'], ),
+                                    sa.PrimaryKeyConstraint('id')
+                                    )
+    op.create_index('ix_file_revision_repo_id_path_mod_time', 'file_revision', ['repo_id', 'path', 'mod_time'],
+                    unique=False)
+
+    # start each file's history with its current version
+    file_commit = sa.table('file_commit',
+                           sa.column('repo_id', sa.Integer),
+                           sa.column('path', sa.String),
+                           sa.column('mod_time', sa.DateTime),
+                           sa.column('sha', sa.String))
+    op.execute(file_revision.insert().from_select(
+        ['repo_id', 'path', 'mod_time', 'sha'],
+        sa.select([file_commit.c.repo_id, file_commit.c.path, file_commit.c.mod_time, file_commit.c.sha])))
+
+
+def downgrade():
+    op.drop_index('ix_file_revision_repo_id_path_mod_time', table_name='file_revision')
+    op.drop_table('file_revision')
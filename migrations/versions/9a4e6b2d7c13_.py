@@ -0,0 +1,55 @@
+"""add answer_cell and its full-text index
+
+Revision ID: 9a4e6b2d7c13
+Revises: 5d0c7f9a2e61
+Create Date: 2026-10-19 16:32:41.508117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9a4e6b2d7c13'
+down_revision = '5d0c7f9a2e61'
+branch_labels = None
+depends_on = None
+
+SQLITE_FTS_STATEMENTS = [
+    "CREATE VIRTUAL TABLE answer_cell_fts USING fts5(source, content='answer_cell', content_rowid='id')",
+    "CREATE TRIGGER answer_cell_ai AFTER INSERT ON answer_cell BEGIN "
+    "INSERT INTO answer_cell_fts(rowid, source) VALUES (new.id, new.source); END",
+    "CREATE TRIGGER answer_cell_ad AFTER DELETE ON answer_cell BEGIN "
+    "INSERT INTO answer_cell_fts(answer_cell_fts, rowid, source) VALUES ('delete', old.id, old.source); END",
+    "CREATE TRIGGER answer_cell_au AFTER UPDATE ON answer_cell BEGIN "
+    "INSERT INTO answer_cell_fts(answer_cell_fts, rowid, source) VALUES ('delete', old.id, old.source); "
+    "INSERT INTO answer_cell_fts(rowid, source) VALUES (new.id, new.source); END",
+]
+
+
+def upgrade():
+    op.create_table('answer_cell',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('assignment_id', sa.Integer(), nullable=False),
+                    sa.Column('position', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('source', sa.Text(), nullable=False),
+                    sa.ForeignKeyConstraint(['assignment_id'], ['assignment.id'], ),
+                    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_answer_cell_assignment_id_user_id', 'answer_cell', ['assignment_id', 'user_id'], unique=False)
+
+    # The cells are filled in as the student files are next updated, and as the assignments are next collated.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_FTS_STATEMENTS:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_answer_cell_source_tsv ON answer_cell USING gin (to_tsvector('english', source))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE answer_cell_fts")
+    op.drop_index('ix_answer_cell_assignment_id_user_id', table_name='answer_cell')
+    op.drop_table('answer_cell')
@@ -0,0 +1,24 @@
+"""add repo.head_sha
+
+Revision ID: a7c3e9f1d265
+Revises: d2e5a7c9b104
+Create Date: 2026-10-19 19:12:40.286137
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f1d265'
+down_revision = 'd2e5a7c9b104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('repo', sa.Column('head_sha', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('repo') as batch_op:
+        batch_op.drop_column('head_sha')
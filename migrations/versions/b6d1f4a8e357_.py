@@ -0,0 +1,58 @@
+"""add notebook cell storage
+
+Revision ID: b6d1f4a8e357
+Revises: 9a4e6b2d7c13
+Create Date: 2026-10-19 17:14:52.276340
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4a8e357'
+down_revision = '9a4e6b2d7c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notebook_cell',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('sha', sa.String(length=40), nullable=False),
+                    sa.Column('cell_data', sa.Text(), nullable=False),
+                    sa.CheckConstraint('length(sha) = 40'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('sha')
+                    )
+    op.create_table('cell_outputs',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('sha', sa.String(length=40), nullable=False),
+                    sa.Column('outputs_data', sa.Text(), nullable=False),
+                    sa.CheckConstraint('length(sha) = 40'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('sha')
+                    )
+    op.create_table('file_content_cell',
+                    sa.Column('file_sha', sa.String(length=40), nullable=False),
+                    sa.Column('position', sa.Integer(), nullable=False),
+                    sa.Column('cell_sha', sa.String(length=40), nullable=False),
+                    sa.Column('outputs_sha', sa.String(length=40), nullable=True),
+                    sa.ForeignKeyConstraint(['cell_sha'], ['notebook_cell.sha'], ),
+                    sa.ForeignKeyConstraint(['file_sha'], ['file_content.sha'], ),
+                    sa.ForeignKeyConstraint(['outputs_sha'], ['cell_outputs.sha'], ),
+                    sa.PrimaryKeyConstraint('file_sha', 'position')
+                    )
+    op.create_index('ix_file_content_cell_cell_sha', 'file_content_cell', ['cell_sha'], unique=False)
+    op.create_index('ix_file_content_cell_outputs_sha', 'file_content_cell', ['outputs_sha'], unique=False)
+    op.add_column('file_content', sa.Column('notebook_data', sa.Text(), nullable=True))
+
+
+def downgrade():
+    # notebooks that are stored as cells must first be restored, with `flask store_notebook_cells --restore`
+    with op.batch_alter_table('file_content') as batch_op:
+        batch_op.drop_column('notebook_data')
+    op.drop_index('ix_file_content_cell_outputs_sha', table_name='file_content_cell')
+    op.drop_index('ix_file_content_cell_cell_sha', table_name='file_content_cell')
+    op.drop_table('file_content_cell')
+    op.drop_table('cell_outputs')
+    op.drop_table('notebook_cell')
@@ -0,0 +1,26 @@
+"""add file_commit.updated_at
+
+Revision ID: b8e2d5f1c637
+Revises: e1f4b8c2d390
+Create Date: 2026-10-19 22:41:08.193627
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b8e2d5f1c637'
+down_revision = 'e1f4b8c2d390'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('file_commit', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # The existing rows were recorded at some time after their commits
+    op.execute('UPDATE file_commit SET updated_at = mod_time')
+
+
+def downgrade():
+    with op.batch_alter_table('file_commit') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,24 @@
+"""add assignment.metadata_sha
+
+Revision ID: c41e8d7b5a20
+Revises: 3f6c2a9e1d47
+Create Date: 2026-10-19 10:03:12.804417
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c41e8d7b5a20'
+down_revision = '3f6c2a9e1d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('assignment', sa.Column('metadata_sha', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('assignment') as batch_op:
+        batch_op.drop_column('metadata_sha')
@@ -0,0 +1,30 @@
+"""add seen_at, and indexes on file shas, for garbage collection
+
+Revision ID: d2e5a7c9b104
+Revises: b6d1f4a8e357
+Create Date: 2026-10-19 17:58:06.913482
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd2e5a7c9b104'
+down_revision = 'b6d1f4a8e357'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table_name in ['file_content', 'notebook_cell', 'cell_outputs']:
+        op.add_column(table_name, sa.Column('seen_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_file_commit_sha', 'file_commit', ['sha'], unique=False)
+    op.create_index('ix_file_revision_sha', 'file_revision', ['sha'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_file_revision_sha', table_name='file_revision')
+    op.drop_index('ix_file_commit_sha', table_name='file_commit')
+    for table_name in ['cell_outputs', 'notebook_cell', 'file_content']:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('seen_at')
@@ -0,0 +1,29 @@
+"""add repo_lease
+
+Revision ID: e1f4b8c2d390
+Revises: a7c3e9f1d265
+Create Date: 2026-10-19 20:03:17.554829
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e1f4b8c2d390'
+down_revision = 'a7c3e9f1d265'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('repo_lease',
+                    sa.Column('repo_id', sa.Integer(), nullable=False),
+                    sa.Column('owner', sa.String(length=100), nullable=False),
+                    sa.Column('expires_at', sa.DateTime(), nullable=False),
+                    sa.ForeignKeyConstraint(['repo_id'], ['repo.id'], ),
+                    sa.PrimaryKeyConstraint('repo_id')
+                    )
+
+
+def downgrade():
+    op.drop_table('repo_lease')
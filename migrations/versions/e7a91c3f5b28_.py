@@ -0,0 +1,26 @@
+"""add indexes for assignment files, forks, and latest file commits
+
+Revision ID: e7a91c3f5b28
+Revises: c41e8d7b5a20
+Create Date: 2026-10-19 14:21:37.512903
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e7a91c3f5b28'
+down_revision = 'c41e8d7b5a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_file_commit_path_repo_id', 'file_commit', ['path', 'repo_id'], unique=False)
+    op.create_index('ix_file_commit_repo_id_mod_time', 'file_commit', ['repo_id', 'mod_time'], unique=False)
+    op.create_index('ix_repo_source_id_refreshed_at', 'repo', ['source_id', 'refreshed_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_repo_source_id_refreshed_at', table_name='repo')
+    op.drop_index('ix_file_commit_repo_id_mod_time', table_name='file_commit')
+    op.drop_index('ix_file_commit_path_repo_id', table_name='file_commit')
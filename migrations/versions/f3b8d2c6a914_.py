@@ -0,0 +1,72 @@
+"""store each commit once, with a repo_commits association
+
+Revision ID: f3b8d2c6a914
+Revises: e7a91c3f5b28
+Create Date: 2026-10-19 15:02:48.220716
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d2c6a914'
+down_revision = 'e7a91c3f5b28'
+branch_labels = None
+depends_on = None
+
+commit_table = sa.table('commit',
+                        sa.column('id', sa.Integer),
+                        sa.column('repo_id', sa.Integer),
+                        sa.column('sha', sa.String),
+                        sa.column('commit_date', sa.DateTime))
+repo_commits_table = sa.table('repo_commits',
+                              sa.column('repo_id', sa.Integer),
+                              sa.column('commit_id', sa.Integer))
+
+
+def upgrade():
+    op.create_table('repo_commits',
+                    sa.Column('repo_id', sa.Integer(), nullable=False),
+                    sa.Column('commit_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['commit_id'], ['commit.id'], ),
+                    sa.ForeignKeyConstraint(['repo_id'], ['repo.id'], ),
+                    sa.PrimaryKeyConstraint('repo_id', 'commit_id')
+                    )
+
+    # keep the first row for each sha, and point each repo's membership at it
+    kept = (sa.select([commit_table.c.sha, sa.func.min(commit_table.c.id).label('id')])
+            .group_by(commit_table.c.sha)
+            .alias('kept'))
+    op.execute(repo_commits_table.insert().from_select(
+        ['repo_id', 'commit_id'],
+        sa.select([commit_table.c.repo_id, kept.c.id])
+        .select_from(commit_table.join(kept, kept.c.sha == commit_table.c.sha))))
+    op.execute(commit_table.delete().where(
+        ~commit_table.c.id.in_(sa.select([sa.func.min(commit_table.c.id)]).group_by(commit_table.c.sha))))
+
+    op.drop_index('ix_commit_repo_id', table_name='commit')
+    with op.batch_alter_table('commit') as batch_op:
+        batch_op.drop_column('repo_id')  # also drops the (repo_id, sha) unique constraint
+    op.drop_index('ix_commit_sha', table_name='commit')
+    op.create_index('ix_commit_sha', 'commit', ['sha'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_commit_sha', table_name='commit')
+    op.create_index('ix_commit_sha', 'commit', ['sha'], unique=False)
+    with op.batch_alter_table('commit') as batch_op:
+        batch_op.add_column(sa.Column('repo_id', sa.Integer(), nullable=True))
+
+    # copy each shared commit into a row for each repo that contains it, then delete the shared rows
+    op.execute(commit_table.insert().from_select(
+        ['repo_id', 'sha', 'commit_date'],
+        sa.select([repo_commits_table.c.repo_id, commit_table.c.sha, commit_table.c.commit_date])
+        .select_from(repo_commits_table.join(commit_table, commit_table.c.id == repo_commits_table.c.commit_id))))
+    op.execute(commit_table.delete().where(commit_table.c.repo_id.is_(None)))
+    op.drop_table('repo_commits')
+
+    with op.batch_alter_table('commit') as batch_op:
+        batch_op.alter_column('repo_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_commit_repo_id_repo', 'repo', ['repo_id'], ['id'])
+        batch_op.create_unique_constraint('uq_commit_repo_id_sha', ['repo_id', 'sha'])
+    op.create_index('ix_commit_repo_id', 'commit', ['repo_id'], unique=False)